@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+
+from click import ClickException
+
+from nudge_bot.api.decoding import loads
+from nudge_bot.api.nudge import nudge_url_target, build_app_search, _last_page
+from nudge_bot.api.rate_limit import RETRYABLE_STATUS, RateLimiter, RequestCounters, backoff_delay, \
+    parse_retry_after
+from nudge_bot.api.records import APP_SUMMARY_PROPERTIES, App, AppSummary
+
+
+class AsyncNudgeClient:
+    # a semaphore bounds the requests in flight, so thousands of lookups can be scheduled at once; pass the rate
+    # limiter and counters of a NudgeClient to share its --rate-limit budget and retry counts
+
+    def __init__(self, api_token, concurrency=20, pool_size=100, max_retries=5, base_url=None,
+                 request_hooks=None, connect_timeout=10, read_timeout=60, project_apps=False, rate_limiter=None,
+                 counters=None) -> None:
+        super().__init__()
+        try:
+            import aiohttp
+        except ImportError:
+            raise ClickException("The asyncio client requires aiohttp, install it with 'pip install aiohttp'")
+        self._aiohttp = aiohttp
+        self.access_token = api_token
+        self.base_url = base_url.rstrip('/') if base_url else nudge_url_target
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.project_apps = project_apps
+        self.rate_limiter = rate_limiter if rate_limiter else RateLimiter()
+        self.counters = counters if counters else RequestCounters()
+        self.request_hooks = list(request_hooks) if request_hooks else []
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = self._aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        self.session = self._aiohttp.ClientSession(connector=self._aiohttp.TCPConnector(limit=self.pool_size),
+                                                   headers={"authorization": f"Bearer {self.access_token}"},
+                                                   timeout=timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.session.close()
+
+    async def _request(self, method, api, body=None):
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                await self._acquire()
+                self.counters.increment('requests')
+                try:
+                    status, content, headers = await self._send(method, api, body)
+                except (asyncio.TimeoutError, self._aiohttp.ClientConnectionError) as e:
+                    if attempt >= self.max_retries:
+                        raise ClickException(f"Error with {method.lower()} {api} {type(e).__name__}")
+                    status, retry_after = type(e).__name__, None
+                else:
+                    if status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                        if status not in RETRYABLE_STATUS:
+                            self.rate_limiter.on_success()
+                        if status == 200:
+                            return loads(content)
+                        raise ClickException(f"Error with {method.lower()} {api} {content.decode('utf-8', 'replace')}")
+                    retry_after = parse_retry_after(headers.get('Retry-After'))
+                    if status == 429:
+                        self.counters.increment('throttled')
+                        self.rate_limiter.on_throttle(retry_after)
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                logging.debug(f"Retrying {api} after {status} in {delay:.2f}s")
+                self.counters.increment('retried')
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _acquire(self):
+        wait = self.rate_limiter.reserve()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.rate_limiter.reserve()
+
+    async def _send(self, method, api, body):
+        for hook in self.request_hooks:
+            hook.request_started()
+        start = time.perf_counter()
+        status, content = 'error', b''
+        try:
+            async with self.session.request(method, f"{self.base_url}{api}", json=body) as response:
+                status, content = response.status, await response.read()
+                return status, content, response.headers
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in self.request_hooks:
+                hook.request_finished(method, api, status, len(content), elapsed)
+
+    async def get(self, api):
+        return await self._request("GET", api)
+
+    async def post(self, api, body):
+        return await self._request("POST", api, body)
+
+    async def _search_pages(self, api, search, per_page=50):
+        first = await self.post(api, dict(search, page=1, per_page=per_page))
+        pages = [first['values']]
+        last_page = _last_page(first, per_page)
+        if last_page and first['next_page']:
+            rest = await asyncio.gather(*(self.post(api, dict(search, page=page, per_page=per_page))
+                                          for page in range(first['next_page'], last_page + 1)))
+            pages.extend(response['values'] for response in rest)
+            return pages
+        response = first
+        while response['next_page']:
+            response = await self.post(api, dict(search, page=response['next_page'], per_page=per_page))
+            pages.append(response['values'])
+        return pages
+
+    async def _search(self, api, search, per_page=50):
+        return [value for values in await self._search_pages(api, search, per_page) for value in values]
+
+    async def _search_apps(self, search, per_page=50, minimal=False):
+        if minimal and self.project_apps:
+            search = dict(search, properties=list(APP_SUMMARY_PROPERTIES))
+        record = AppSummary.from_json if minimal else App.from_json
+        return [record(app) for app in await self._search("/apps/search", search, per_page)]
+
+    async def find_app(self, app_name, exact=False, minimal=False):
+        return await self._search_apps(build_app_search(app_name, exact=exact), minimal=minimal)
+
+    async def get_supply_chain(self, canonical_domain):
+        return (await self.get(f'/api/service/vendors/{canonical_domain}'))['vendors']
+
+    async def get_service_info(self, canonical_domain):
+        return await self.get(f'/api/service/details/{canonical_domain}')
+
+
+def run_async(api_token, work, concurrency=20, pool_size=100, max_retries=5, base_url=None, request_hooks=None,
+              connect_timeout=10, read_timeout=60, deadline=None, project_apps=False, rate_limiter=None,
+              counters=None):
+    # `work` receives an open AsyncNudgeClient and returns the coroutine to run, `deadline` bounds it in seconds
+    async def main():
+        async with AsyncNudgeClient(api_token, concurrency=concurrency, pool_size=pool_size, max_retries=max_retries,
+                                    base_url=base_url, request_hooks=request_hooks, connect_timeout=connect_timeout,
+                                    read_timeout=read_timeout, project_apps=project_apps,
+                                    rate_limiter=rate_limiter, counters=counters) as client:
+            if deadline is None:
+                return await work(client)
+            try:
+                return await asyncio.wait_for(work(client), max(0.0, deadline))
+            except asyncio.TimeoutError:
+                raise ClickException("Deadline exceeded")
+
+    return asyncio.run(main())
+
+
+def run_with_client(nudge_client, work, concurrency):
+    # runs `work` with the settings, rate limit budget, counters and remaining deadline of a NudgeClient
+    return run_async(nudge_client.access_token, work, concurrency=concurrency, pool_size=nudge_client.pool_size,
+                     max_retries=nudge_client.max_retries, base_url=nudge_client.base_url,
+                     request_hooks=nudge_client.request_hooks, connect_timeout=nudge_client.connect_timeout,
+                     read_timeout=nudge_client.read_timeout, deadline=nudge_client.remaining_time(),
+                     project_apps=nudge_client.project_apps, rate_limiter=nudge_client.rate_limiter,
+                     counters=nudge_client.counters)
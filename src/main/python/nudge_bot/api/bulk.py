@@ -0,0 +1,114 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from click import ClickException
+
+from nudge_bot.api.decoding import decode_response
+from nudge_bot.api.rate_limit import DeadlineExceeded
+
+# statuses telling us the bulk endpoint does not exist for this API
+UNSUPPORTED_STATUS = (404, 405, 501)
+
+
+def _write_error(error):
+    if isinstance(error, ClickException):
+        return error.format_message()
+    return str(error)
+
+
+def _updated_count(response):
+    try:
+        updated = decode_response(response).get('updated')
+    except (ValueError, AttributeError):
+        return None
+    return updated if isinstance(updated, int) and not isinstance(updated, bool) else None
+
+
+class BulkFieldWriter:
+    # a chunk only counts as applied when {"updated": <count>} covers all of it, anything else is resent as
+    # single writes; an endpoint that is missing or does not report the count is not used again
+
+    def __init__(self, nudge_client, endpoint, workers=4, chunk_size=50, min_chunk=10, max_chunk=500,
+                 target_latency=2.0) -> None:
+        super().__init__()
+        self.nudge_client = nudge_client
+        self.endpoint = endpoint
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.target_latency = target_latency
+        self.supported = None
+
+    def write(self, writes):
+        # writes are (tag, app_id, field_id, value), results are (tag, error) with error None on success
+        groups = defaultdict(list)
+        for write in writes:
+            tag, app_id, field_id, value = write
+            key = (str(field_id), str(value))
+            groups[key].append(write)
+            if len(groups[key]) >= self.chunk_size:
+                yield from self._flush(key, groups.pop(key))
+        for key, group in groups.items():
+            yield from self._flush(key, group)
+
+    def _flush(self, key, group):
+        if self.supported is not False:
+            results = self._send_bulk(key, group)
+            if results is not None:
+                return results
+        return self._send_single(group)
+
+    def _send_bulk(self, key, group):
+        field_id, value = key
+        start = time.monotonic()
+        try:
+            response = self.nudge_client.bulk_set_app_field(self.endpoint, field_id, value,
+                                                            [app_id for tag, app_id, f, v in group])
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logging.debug(f"Bulk update of field {field_id} failed {e}")
+            self._adapt(ok=False, latency=time.monotonic() - start)
+            return None
+        if response.status_code in UNSUPPORTED_STATUS:
+            self.supported = False
+            return None
+        if response.status_code != 200:
+            # retry the chunk one app at a time so every failure is reported against its row
+            self._adapt(ok=False, latency=time.monotonic() - start)
+            return None
+        updated = _updated_count(response)
+        if updated is None:
+            logging.warning(f"Bulk endpoint {self.endpoint} did not report the updated apps, using single writes")
+            self.supported = False
+            return None
+        if updated != len(group):
+            logging.debug(f"Bulk update of field {field_id} updated {updated} of {len(group)} apps")
+            self._adapt(ok=False, latency=time.monotonic() - start)
+            return None
+        self.supported = True
+        self._adapt(ok=True, latency=time.monotonic() - start)
+        return [(tag, None) for tag, app_id, f, v in group]
+
+    def _send_single(self, group):
+        def send(write):
+            tag, app_id, field_id, value = write
+            try:
+                self.nudge_client.set_app_field(app_id, field_id, value)
+                return tag, None
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                return tag, _write_error(e)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(send, group))
+
+    def _adapt(self, ok, latency):
+        if ok and latency <= self.target_latency:
+            self.chunk_size = min(self.max_chunk, self.chunk_size + self.min_chunk)
+        else:
+            self.chunk_size = max(self.min_chunk, self.chunk_size // 2)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from nudge_bot.api.decoding import loads
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'nudge-bot')
+
+
+def token_namespace(api_token):
+    return hashlib.sha256(str(api_token).encode('utf-8')).hexdigest()[:16]
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+
+    def __init__(self, value, etag, stored_at) -> None:
+        super().__init__()
+        self.value = value
+        self.etag = etag
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored_at < ttl
+
+
+class ResponseCache:
+    # entries are namespaced by a hash of the API token so tenants never see each other's data
+
+    def __init__(self, api_token, path=None, max_entries=5000, refresh=False) -> None:
+        super().__init__()
+        path = path if path else default_cache_dir()
+        os.makedirs(path, exist_ok=True)
+        self.namespace = token_namespace(api_token)
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(path, 'cache.sqlite'), check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+            namespace TEXT NOT NULL, key TEXT NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL, etag TEXT,
+            stored_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (namespace, accessed_at)")
+        self._connection.commit()
+
+    def get(self, key):
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT value, etag, stored_at FROM entries WHERE namespace = ? AND key = ?",
+                                           (self.namespace, key)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                                     (time.time(), self.namespace, key))
+            self._connection.commit()
+        return CacheEntry(loads(row[0]), row[1], row[2])
+
+    def put(self, kind, key, value, etag=None):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (self.namespace, key, kind, json.dumps(value), etag, now, now))
+            self._connection.execute("""DELETE FROM entries WHERE namespace = ? AND key IN (
+                SELECT key FROM entries WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""",
+                                     (self.namespace, self.namespace, self.max_entries))
+            self._connection.commit()
+
+    def touch(self, key):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("UPDATE entries SET stored_at = ?, accessed_at = ? "
+                                     "WHERE namespace = ? AND key = ?", (now, now, self.namespace, key))
+            self._connection.commit()
+
+    def invalidate(self, kind):
+        with self._lock:
+            self._connection.execute("DELETE FROM entries WHERE namespace = ? AND kind = ?", (self.namespace, kind))
+            self._connection.commit()
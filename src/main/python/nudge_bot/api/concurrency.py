@@ -0,0 +1,16 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def bounded_map(function, items, workers, window=None):
+    # like executor.map but items are read lazily: at most `window` calls (default `workers`) are submitted ahead
+    # of the consumer, so memory stays flat on long inputs and results still come back in input order
+    window = window if window else workers
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
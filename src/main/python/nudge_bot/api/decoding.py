@@ -0,0 +1,22 @@
+import json
+
+# the fastest JSON decoder installed, orjson and msgspec are optional (pip install orjson)
+try:
+    import orjson
+
+    loads = orjson.loads
+    DECODER = 'orjson'
+except ImportError:
+    try:
+        import msgspec
+
+        loads = msgspec.json.decode
+        DECODER = 'msgspec'
+    except ImportError:
+        loads = json.loads
+        DECODER = 'json'
+
+
+def decode_response(response):
+    # the raw body skips the charset detection and stdlib decoding of requests' Response.json()
+    return loads(response.content)
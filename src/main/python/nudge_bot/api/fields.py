@@ -0,0 +1,40 @@
+class FieldRegistry:
+    # field lookups by id, case-folded name and allowed value are dictionary hits instead of list scans
+
+    def __init__(self, fields) -> None:
+        super().__init__()
+        self.fields = []
+        self._by_id = {}
+        self._by_name = {}
+        self._values = {}
+        for field in fields:
+            self.add_field(field)
+
+    def add_field(self, field):
+        self.fields.append(field)
+        self._by_id[str(field['id'])] = field
+        self._by_name[field['name'].casefold()] = field
+        for allowed_value in field.get('allowed_values') or []:
+            self._index_value(field, allowed_value)
+
+    def add_allowed_value(self, field_identifier, allowed_value):
+        field = self.by_id(field_identifier)
+        if field is None:
+            return
+        field.setdefault('allowed_values', []).append(allowed_value)
+        self._index_value(field, allowed_value)
+
+    def _index_value(self, field, allowed_value):
+        self._values[(str(field['id']), allowed_value['value'].casefold())] = allowed_value.get('id')
+
+    def by_id(self, field_identifier):
+        return self._by_id.get(str(field_identifier))
+
+    def by_name(self, field_name):
+        return self._by_name.get(field_name.casefold())
+
+    def value_exists(self, field_identifier, value: str):
+        return (str(field_identifier), value.casefold()) in self._values
+
+    def allowed_value_id(self, field_identifier, value: str):
+        return self._values.get((str(field_identifier), value.casefold()))
@@ -0,0 +1,109 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import quoteattr
+
+from nudge_bot.api.async_nudge import run_with_client
+from nudge_bot.api.nudge import NudgeClient
+
+
+class SupplyChainGraph:
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.nodes = {}
+        self.edges = set()
+        # (domain, error) of the vendor lookups that failed, their vendors are missing from the graph
+        self.failures = []
+
+    def add_node(self, domain, name=None, depth=0):
+        node = self.nodes.get(domain)
+        if node is None:
+            self.nodes[domain] = {"id": domain, "name": name if name else domain, "depth": depth}
+        elif name and node['name'] == domain:
+            node['name'] = name
+
+    def add_edge(self, source, target):
+        self.edges.add((source, target))
+
+    def write_edges(self, out):
+        out.write("source,target\n")
+        for source, target in sorted(self.edges):
+            out.write(f"{source},{target}\n")
+
+    def write_json(self, out):
+        json.dump({"nodes": list(self.nodes.values()),
+                   "edges": [{"source": source, "target": target} for source, target in sorted(self.edges)]},
+                  out, indent=2)
+
+    def write_graphml(self, out):
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        out.write('  <key id="name" for="node" attr.name="name" attr.type="string"/>\n')
+        out.write('  <key id="depth" for="node" attr.name="depth" attr.type="int"/>\n')
+        out.write('  <graph id="supply-chain" edgedefault="directed">\n')
+        for node in self.nodes.values():
+            out.write(f'    <node id={quoteattr(node["id"])}><data key="name">{_text(node["name"])}</data>'
+                      f'<data key="depth">{node["depth"]}</data></node>\n')
+        for source, target in sorted(self.edges):
+            out.write(f'    <edge source={quoteattr(source)} target={quoteattr(target)}/>\n')
+        out.write('  </graph>\n</graphml>\n')
+
+
+def _text(value):
+    return quoteattr(str(value))[1:-1]
+
+
+def _fetch_vendors(nudge_client: NudgeClient, domain):
+    try:
+        return nudge_client.get_supply_chain(domain), None
+    except Exception as e:
+        return [], str(e)
+
+
+async def _fetch_vendors_async(client, domain):
+    try:
+        return await client.get_supply_chain(domain), None
+    except Exception as e:
+        return [], str(e)
+
+
+def _fetch_level_async(nudge_client: NudgeClient, domains, workers):
+    async def fetch_all(client):
+        return await asyncio.gather(*(_fetch_vendors_async(client, domain) for domain in domains))
+
+    return run_with_client(nudge_client, fetch_all, concurrency=workers)
+
+
+def crawl_supply_chain(nudge_client: NudgeClient, roots, max_depth=2, workers=8, on_level=None):
+    # breadth first, every domain is fetched once no matter how many apps share it as a vendor
+    graph = SupplyChainGraph()
+    frontier = []
+    for domain, name in roots:
+        if domain and domain not in graph.nodes:
+            graph.add_node(domain, name, 0)
+            frontier.append(domain)
+    depth = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while frontier and depth < max_depth:
+            depth += 1
+            if on_level:
+                on_level(depth, len(frontier))
+            if nudge_client.use_async:
+                results = _fetch_level_async(nudge_client, frontier, workers)
+            else:
+                results = executor.map(lambda d: _fetch_vendors(nudge_client, d), frontier)
+            next_frontier = []
+            for domain, (vendors, error) in zip(frontier, results):
+                if error is not None:
+                    graph.failures.append((domain, error))
+                for vendor in vendors:
+                    target = vendor.get('domain_canonical')
+                    if not target:
+                        continue
+                    if target not in graph.nodes:
+                        next_frontier.append(target)
+                    graph.add_node(target, vendor.get('app_name'), depth)
+                    graph.add_edge(domain, target)
+            frontier = next_frontier
+    return graph
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from nudge_bot.api.rate_limit import RequestCounters
+from nudge_bot.api.stats import percentile
+
+
+class LatencyWindow:
+
+    def __init__(self, size=200) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def record(self, elapsed):
+        with self._lock:
+            self._latencies.append(elapsed)
+
+    def percentile(self, percent):
+        with self._lock:
+            ordered = sorted(self._latencies)
+        return percentile(ordered, percent)
+
+
+def _submit(function, *args):
+    # a daemon thread per copy, the copy that lost may still be waiting on its read timeout and must not
+    # keep the process alive once the command is done
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, name="nudge-hedge", daemon=True).start()
+    return future
+
+
+class Hedger:
+    # a read slower than the recent p95 gets one duplicate and the first answer wins, reads are sent once
+    # until min_samples latencies of the endpoint are known
+
+    def __init__(self, counters=None, percent=95, min_samples=20, min_delay=0.05) -> None:
+        super().__init__()
+        self.counters = counters if counters else RequestCounters()
+        self.percent = percent
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def _window(self, key) -> LatencyWindow:
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = LatencyWindow()
+            return window
+
+    def delay(self, key):
+        window = self._window(key)
+        if len(window) < self.min_samples:
+            return None
+        return max(self.min_delay, window.percentile(self.percent))
+
+    def _timed(self, key, call):
+        start = time.perf_counter()
+        response = call()
+        if response.status_code == 200:
+            self._window(key).record(time.perf_counter() - start)
+        return response
+
+    def send(self, key, call, duplicate=None):
+        # duplicate sends the second copy, by default the same call
+        delay = self.delay(key)
+        if delay is None:
+            return self._timed(key, call)
+        first = _submit(self._timed, key, call)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        self.counters.increment('hedged')
+        second = _submit(self._timed, key, duplicate if duplicate else call)
+        done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+        succeeded = [future for future in (first, second) if future in done and future.exception() is None]
+        if succeeded:
+            if succeeded[0] is second:
+                self.counters.increment('hedges_won')
+            return succeeded[0].result()
+        # the copy that finished failed, the outcome of the other one decides
+        return (second if first in done else first).result()
@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+
+from nudge_bot.api.cache import default_cache_dir, token_namespace
+from nudge_bot.api.decoding import loads
+from nudge_bot.api.nudge import _is_domain, _transform_app_name
+from nudge_bot.api.records import App
+
+
+def inventory_path(api_token, cache_dir=None):
+    return os.path.join(cache_dir if cache_dir else default_cache_dir(),
+                        f"inventory-{token_namespace(api_token)}.json.gz")
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _TextIndex:
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.exact = defaultdict(set)
+        self.trigrams = defaultdict(set)
+        self.texts = defaultdict(list)
+
+    def add(self, position, text):
+        if not text:
+            return
+        text = text.casefold()
+        self.exact[text].add(position)
+        self.texts[position].append(text)
+        for trigram in _trigrams(f"  {text} "):
+            self.trigrams[trigram].add(position)
+
+    def match_exact(self, term):
+        return set(self.exact.get(term.casefold(), ()))
+
+    def match_contains(self, term):
+        term = term.casefold()
+        trigrams = _trigrams(term)
+        if not trigrams:
+            candidates = self.texts.keys()
+        else:
+            # every trigram of the term must appear in a text containing it, verify the survivors
+            candidates = set.intersection(*(self.trigrams.get(trigram, set()) for trigram in trigrams))
+        return {position for position in candidates if any(term in text for text in self.texts[position])}
+
+    def match_fuzzy(self, term):
+        trigrams = _trigrams(f"  {term.casefold()} ")
+        scores = defaultdict(int)
+        for trigram in trigrams:
+            for position in self.trigrams.get(trigram, ()):
+                scores[position] += 1
+        best = {}
+        for position, shared in scores.items():
+            for text in self.texts[position]:
+                score = shared / len(trigrams | _trigrams(f"  {text} "))
+                best[position] = max(best.get(position, 0), score)
+        return best
+
+
+class AppInventory:
+    # every app of an organization, indexed in memory by name and domain
+
+    def __init__(self, apps, synced_at=None) -> None:
+        super().__init__()
+        self.apps = [App.from_json(app) for app in apps]
+        self.synced_at = synced_at if synced_at else time.time()
+        self._names = _TextIndex()
+        self._domains = _TextIndex()
+        for position, app in enumerate(self.apps):
+            self._names.add(position, app.name)
+            self._names.add(position, app.service_name)
+            self._domains.add(position, app.domain_canonical)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rb') as snapshot:
+            content = loads(snapshot.read())
+        return cls(content['apps'], content['synced_at'])
+
+    def age(self):
+        return time.time() - self.synced_at
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as snapshot:
+            json.dump({"synced_at": self.synced_at, "apps": [app.to_json() for app in self.apps]}, snapshot,
+                      separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    def _apps(self, positions):
+        return sorted((self.apps[position] for position in positions),
+                      key=lambda app: app.account_count or 0, reverse=True)
+
+    def _index(self, app_name):
+        return self._domains if _is_domain(app_name) else self._names
+
+    def find(self, app_name, exact=False):
+        term = _transform_app_name(app_name)
+        index = self._index(app_name)
+        positions = index.match_exact(term) if exact else index.match_contains(term)
+        return self._apps(positions)
+
+    def find_similar(self, app_name, limit=5, threshold=0.25):
+        scores = self._index(app_name).match_fuzzy(_transform_app_name(app_name))
+        ranked = sorted((score, position) for position, score in scores.items() if score >= threshold)
+        return [self.apps[position] for score, position in reversed(ranked[-limit:])]
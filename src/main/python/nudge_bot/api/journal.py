@@ -0,0 +1,48 @@
+import os
+
+
+def default_journal_path(input_name):
+    if not input_name or input_name.startswith('<'):
+        return None
+    return f"{os.path.abspath(input_name)}.journal"
+
+
+class WriteJournal:
+    # one app_id,field_id,value line is flushed per completed write, without a path nothing is read or written
+
+    def __init__(self, path, resume=False) -> None:
+        super().__init__()
+        self.path = path
+        self.applied = set()
+        self.skipped = 0
+        if resume and path and os.path.exists(path):
+            with open(path, 'r') as journal:
+                for line in journal:
+                    entry = line.rstrip('\n').split(',', 2)
+                    if len(entry) == 3:
+                        self.applied.add(tuple(entry))
+        self._file = open(path, 'a' if resume else 'w') if path else None
+
+    @staticmethod
+    def _key(app_id, field_id, value):
+        return str(app_id).strip(), str(field_id), str(value)
+
+    def is_applied(self, app_id, field_id, value):
+        return self._key(app_id, field_id, value) in self.applied
+
+    def record(self, app_id, field_id, value):
+        if self._file is None:
+            return
+        key = self._key(app_id, field_id, value)
+        self._file.write(f"{','.join(key)}\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
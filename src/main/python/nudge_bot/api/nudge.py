@@ -1,17 +1,60 @@
+import functools
+import gzip
+import json
 import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from click import ClickException
-from tldextract import tldextract
+from requests.adapters import HTTPAdapter
+
+from nudge_bot.api.bulk import BulkFieldWriter
+from nudge_bot.api.cache import ResponseCache, cache_key
+from nudge_bot.api.concurrency import bounded_map
+from nudge_bot.api.decoding import decode_response
+from nudge_bot.api.fields import FieldRegistry
+from nudge_bot.api.hedge import Hedger
+from nudge_bot.api.rate_limit import DeadlineExceeded, RateLimiter, RequestCounters, RETRYABLE_STATUS, \
+    backoff_delay, parse_retry_after
+from nudge_bot.api.records import APP_SUMMARY_PROPERTIES, App, AppSummary
+from nudge_bot.api.stats import endpoint_name
 
 nudge_url_target = "https://api.nudgesecurity.io/api/1.0"
+# idempotent reads that may be sent twice when hedging
+hedged_apis = ("/apps/search", "/api/service/details/", "/api/service/vendors/")
+
+
+_tld_extractor = None
+_tld_lock = threading.Lock()
+
+
+def _get_tld_extractor():
+    global _tld_extractor
+    with _tld_lock:
+        if _tld_extractor is None:
+            # tldextract is only imported once a domain is resolved, and never fetches the suffix list over the
+            # network: it reads NUDGE_TLD_SUFFIX_FILE when set, otherwise the snapshot bundled with the package
+            from tldextract import TLDExtract
+            suffix_file = os.environ.get('NUDGE_TLD_SUFFIX_FILE')
+            suffix_list_urls = (f"file://{os.path.abspath(suffix_file)}",) if suffix_file else ()
+            _tld_extractor = TLDExtract(cache_dir=os.environ.get('NUDGE_TLD_CACHE_DIR'),
+                                        suffix_list_urls=suffix_list_urls, fallback_to_snapshot=True)
+        return _tld_extractor
+
+
+@functools.lru_cache(maxsize=65536)
+def _extract_domain(app_name):
+    return str(_get_tld_extractor()(app_name).domain)
 
 
 def _transform_app_name(app_name):
     is_domain = _is_domain(app_name)
     if is_domain:
-        loc = tldextract.extract(app_name)
-        return str(loc.domain)
+        return _extract_domain(app_name)
     return app_name
 
 
@@ -19,76 +62,316 @@ def _is_domain(app_name):
     return 'http' in app_name
 
 
+def search_key(app_name):
+    # names that produce the same app search share a key
+    return _is_domain(app_name), _transform_app_name(app_name).casefold()
+
+
+def build_field_search(field_name=None, field_value=None):
+    search = {"search": [],
+              "filters": [],
+              "sorting": {"property": "account_count", "direction": "desc"}}
+    for field, value in zip(field_name, field_value):
+        if value == 'None':
+            search['search'].append({"property": "fields", "op": "isnull", "field_name": field, "value": value})
+        else:
+            search['search'].append({"property": "fields", "op": "=", "field_name": field, "value": value})
+    return search
+
+
+def build_category_search(category):
+    return {"search": [{"property": "category", "op": "=", "value": category}],
+            "filters": [],
+            "sorting": {"property": "account_count", "direction": "desc"}}
+
+
+def build_app_search(app_name, exact=False):
+    is_domain = _is_domain(app_name)
+    app_name = _transform_app_name(app_name)
+    # {"search":[{"field":"service_info.name","op":"ilike","value":"%Zoom%"},{"field":"service_info.category.name","op":"ilike","value":"%Zoom%"}],"filters":[],"page":1,"per_page":50,"sort":"account_count","sort_dir":"desc"}
+    if exact:
+        op = "="
+        val = f"{app_name}"
+    else:
+        op = "ilike"
+        val = f"%{app_name}%"
+    search = {"search": [],
+              "filters": [],
+              "sorting": {"property": "account_count", "direction": "desc"}}
+    if is_domain:
+        search['search'].append({"property": "domain_canonical", "op": op, "value": val})
+    else:
+        search['search'].append({"property": "service_info.name", "op": op, "value": val})
+        search['search'].append({"property": "name", "op": op, "value": val})
+    return search
+
+
+def _last_page(response, per_page):
+    if response.get('total_pages'):
+        return int(response['total_pages'])
+    if response.get('total'):
+        return math.ceil(int(response['total']) / per_page)
+    return None
+
+
+def _create_session(pool_size):
+    session = requests.session()
+    # a blocking pool bounds open connections to pool_size and lets concurrent callers reuse warm ones
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+    return session
+
+
 class NudgeClient:
 
-    def __init__(self, api_token) -> None:
+    def __init__(self, api_token, rate_limit=None, max_retries=5, pool_size=10, compress_requests=False,
+                 cache: ResponseCache = None, cache_ttl=600, field_workers=4, inventory_loader=None,
+                 use_async=False, base_url=None, connect_timeout=10, read_timeout=60, deadline=None, hedge=False,
+                 project_apps=False) -> None:
         super().__init__()
+        self.base_url = base_url.rstrip('/') if base_url else nudge_url_target
+        self.use_async = use_async
         self.fields = None
+        self._inventory_loader = inventory_loader
+        self._inventory = None
+        self._inventory_lock = threading.Lock()
+        self.field_workers = field_workers
+        self._field_registry = None
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self._apps_invalidated = False
+        self._bulk_writer = None
         self.access_token = api_token
-        self.session = requests.session()
+        self.pool_size = pool_size
+        self.session = _create_session(pool_size)
+        self.compress_requests = compress_requests
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.counters = RequestCounters()
+        self.request_hooks = []
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline_seconds = deadline
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.hedger = Hedger(counters=self.counters) if hedge else None
+        self.project_apps = project_apps
 
     def get_bearer_token(self):
         pass
 
+    def add_request_hook(self, hook):
+        # hooks see every attempt: request_started() before it is sent and
+        # request_finished(method, api, status, size, elapsed) once the response (or error) is in
+        self.request_hooks.append(hook)
+
+    def _send(self, send, url, **kwargs):
+        if not self.request_hooks:
+            return send(url, **kwargs)
+        for hook in self.request_hooks:
+            hook.request_started()
+        start = time.perf_counter()
+        status, size = 'error', 0
+        try:
+            response = send(url, **kwargs)
+            status, size = response.status_code, len(response.content)
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in self.request_hooks:
+                hook.request_finished(send.__name__.upper(), self._api(url), status, size, elapsed)
+
+    def _api(self, url):
+        return url[len(self.base_url):] if url.startswith(self.base_url) else url
+
+    def remaining_time(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def _check_deadline(self, url):
+        remaining = self.remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.deadline_seconds}s exceeded before {self._api(url)}")
+        return remaining
+
+    def _timeout(self, remaining):
+        if remaining is None:
+            return self.connect_timeout, self.read_timeout
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def _hedge_key(self, send, url):
+        if self.hedger is None or send.__name__ not in ('get', 'post'):
+            return None
+        api = self._api(url)
+        return endpoint_name(send.__name__.upper(), api) if api.startswith(hedged_apis) else None
+
+    def _send_duplicate(self, send, url, **kwargs):
+        # the hedged copy is a request like any other, it waits for the rate limiter and is counted
+        self.rate_limiter.acquire()
+        self.counters.increment('requests')
+        return self._send(send, url, **kwargs)
+
+    def _request(self, send, url, idempotent=True, **kwargs):
+        # a request that is not idempotent is only retried when throttled, which the server answers before
+        # doing anything; a timeout or 5xx may come after the create was applied and a retry would repeat it
+        retryable = RETRYABLE_STATUS if idempotent else (429,)
+        attempt = 0
+        hedge_key = self._hedge_key(send, url)
+        while True:
+            remaining = self._check_deadline(url)
+            self.rate_limiter.acquire()
+            self.counters.increment('requests')
+            kwargs['timeout'] = self._timeout(remaining)
+            try:
+                if hedge_key:
+                    response = self.hedger.send(hedge_key, lambda: self._send(send, url, **kwargs),
+                                                lambda: self._send_duplicate(send, url, **kwargs))
+                else:
+                    response = self._send(send, url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                # a hung or dropped connection is retried like an unavailable server
+                if attempt >= self.max_retries or not idempotent:
+                    raise ClickException(f"Request failed {self._api(url)} - {e}")
+                status, delay = type(e).__name__, backoff_delay(attempt)
+            else:
+                if response.status_code not in retryable or attempt >= self.max_retries:
+                    if response.status_code not in RETRYABLE_STATUS:
+                        self.rate_limiter.on_success()
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status_code == 429:
+                    self.counters.increment('throttled')
+                    self.rate_limiter.on_throttle(retry_after)
+                status = response.status_code
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            remaining = self._check_deadline(url)
+            if remaining is not None:
+                delay = min(delay, remaining)
+            logging.debug(f"Retrying {url} after {status} in {delay:.2f}s")
+            self.counters.increment('retried')
+            attempt += 1
+            time.sleep(delay)
+
     def get(self, url, auth=True):
-        response = requests.get(f"{nudge_url_target}{url}", headers=self._get_auth_header() if auth else None)
+        response = self._request(self.session.get, f"{self.base_url}{url}",
+                                 headers=self._get_auth_header() if auth else None)
         if response.status_code == 200:
-            return response.json()
+            return decode_response(response)
         else:
             logging.debug(response)
             raise Exception(f"Request failed {url} - {response.status_code}")
 
-    def post(self, api, body):
-        response = self.session.post(f"{nudge_url_target}{api}", json=body,
-                                     headers=self._get_auth_header())
+    def post(self, api, body, idempotent=True):
+        response = self._request(self.session.post, f"{self.base_url}{api}", idempotent=idempotent,
+                                 **self._encode_body(body))
         if response.status_code == 200:
-            return response.json()
+            return decode_response(response)
 
         else:
             raise ClickException(f"Error with post {api} {response.json()}")
 
+    def cached_post(self, kind, api, body):
+        if not self.cache:
+            return self.post(api, body)
+        response = self._cached_request(kind, self.session.post, api, self.cache_ttl, self._encode_body(body),
+                                        cache_key(self.base_url, api, body))
+        if isinstance(response, requests.Response):
+            raise ClickException(f"Error with post {api} {response.json()}")
+        return response
+
+    def cached_get(self, kind, api, ttl):
+        if not self.cache:
+            return self.get(api)
+        response = self._cached_request(kind, self.session.get, api, ttl, {"headers": self._get_auth_header()},
+                                        cache_key(self.base_url, api))
+        if isinstance(response, requests.Response):
+            logging.debug(response)
+            raise Exception(f"Request failed {api} - {response.status_code}")
+        return response
+
+    def _cached_request(self, kind, send, api, ttl, kwargs, key):
+        # returns the decoded body, or the response itself when the request failed
+        entry = self.cache.get(key)
+        if entry and entry.is_fresh(ttl):
+            return entry.value
+        if entry and entry.etag:
+            kwargs['headers']['If-None-Match'] = entry.etag
+        response = self._request(send, f"{self.base_url}{api}", **kwargs)
+        if response.status_code == 304 and entry:
+            self.cache.touch(key)
+            return entry.value
+        if response.status_code == 200:
+            value = decode_response(response)
+            self.cache.put(kind, key, value, response.headers.get('ETag'))
+            return value
+        return response
+
+    def _invalidate(self, kind):
+        if self.cache:
+            self.cache.invalidate(kind)
+
     def put(self, api, body):
-        response = self.session.put(f"{nudge_url_target}{api}", json=body,
-                                    headers=self._get_auth_header())
+        response = self._request(self.session.put, f"{self.base_url}{api}", **self._encode_body(body))
         if response.status_code == 200:
-            return response.json()
+            return decode_response(response)
         else:
             raise ClickException(f"Error with put {api} {response.json()}")
 
+    def _encode_body(self, body):
+        headers = self._get_auth_header()
+        if not self.compress_requests:
+            return {"json": body, "headers": headers}
+        headers["Content-Type"] = "application/json"
+        headers["Content-Encoding"] = "gzip"
+        return {"data": gzip.compress(json.dumps(body).encode('utf-8')), "headers": headers}
+
     def _get_auth_header(self):
         bearer_token = self.access_token
         headers = {"authorization": f"Bearer {bearer_token}"}
         return headers
 
     def list_fields(self):
+        # fields are only fetched the first time a command needs them
         if not self.fields:
             search = {"search": [],
-                      "filters": [], "page": 1, "per_page": 50}
-
-            response_json = self.post(f"/fields/search", search)
-            self.fields = response_json['values']
+                      "filters": []}
+            fields = []
+            for values in self._iter_pages("/fields/search", 'fields', search, per_page=50,
+                                           workers=self.field_workers):
+                fields.extend(values)
+            self.fields = fields
         return self.fields
 
+    @property
+    def inventory(self):
+        # the snapshot is only read once a lookup needs it, commands that never resolve an app skip the load
+        if self._inventory is None and self._inventory_loader:
+            with self._inventory_lock:
+                if self._inventory is None:
+                    self._inventory = self._inventory_loader()
+        return self._inventory
+
+    @property
+    def field_registry(self) -> FieldRegistry:
+        if self._field_registry is None:
+            self._field_registry = FieldRegistry(self.list_fields())
+        return self._field_registry
+
+    def _reset_fields(self):
+        self._invalidate('fields')
+        self.fields = None
+        self._field_registry = None
+
     def get_ids_for_field(self, field: str, value=None):
-        field_id = None
-        value_id = None
-        field_list = self.list_fields()
-        for field_def in field_list:
-            if field.lower() == field_def['name'].lower():
-                field_id = field_def['id']
-        if not field_id:
+        field_def = self.field_registry.by_name(field)
+        if not field_def:
             raise ClickException(f"Can not locate field and value {field}")
-        return field_id
-
+        return field_def['id']
 
     def value_exists(self, field_identifier, value:str):
-        field_list = self.list_fields()
-        for field in field_list:
-            if str(field['id']) == field_identifier:
-                for exist_value in field['allowed_values']:
-                    if exist_value['value'].lower() == value.lower():
-                        return True
-        return False
+        return self.field_registry.value_exists(field_identifier, value)
 
     def set_app_field(self, app_id, field_id, value_id):
         body = {
@@ -96,64 +379,124 @@ class NudgeClient:
         }
         api = f"/apps/{app_id}/fields/{field_id}"
         self.post(api, body)
+        self._apps_changed()
         return True
 
-    def find_app_by_field(self, field_name=None, field_value=None, page=None):
-        search = {"search": [],
-                  "filters": [], "page": 1 if not page else page, "per_page": 100,
-                  "sorting": {"property": "account_count", "direction": "desc"}}
-        for field, value in zip(field_name, field_value):
-            if value == 'None':
-                search['search'].append({"property": "fields", "op": "isnull", "field_name": field, "value": value})
-            else:
-                search['search'].append({"property": "fields", "op": "=", "field_name": field, "value": value})
-        response = self.post("/apps/search", search)
-        ret = response['values']
-        if response['next_page']:
-            ret.extend(self.find_app_by_field(field_name, field_value, response['next_page']))
-        return ret
+    def _apps_changed(self):
+        if not self._apps_invalidated:
+            # cached searches include field values, drop them once per run rather than on every write
+            self._apps_invalidated = True
+            self._invalidate('apps')
+
+    def bulk_set_app_field(self, endpoint, field_id, value_id, app_ids):
+        # endpoint is a path template such as /fields/{field_id}/apps, the API does not document one
+        body = {
+            "value": str(value_id),
+            "app_ids": [str(app_id).strip() for app_id in app_ids]
+        }
+        response = self._request(self.session.post, f"{self.base_url}{endpoint.format(field_id=field_id)}",
+                                 **self._encode_body(body))
+        if response.status_code == 200:
+            self._apps_changed()
+        return response
+
+    def set_app_fields(self, writes, endpoint, workers=4):
+        if self._bulk_writer is None or self._bulk_writer.endpoint != endpoint:
+            self._bulk_writer = BulkFieldWriter(self, endpoint, workers=workers)
+        self._bulk_writer.workers = workers
+        return self._bulk_writer.write(writes)
+
+    def field_search(self, field_name=None, field_value=None):
+        return build_field_search(field_name, field_value)
+
+    def category_search(self, category):
+        return build_category_search(category)
+
+    def app_search(self, app_name, exact=False):
+        return build_app_search(app_name, exact=exact)
+
+    def app_ids_with_field_value(self, field_name, value):
+        # read from the live API, a snapshot or cached search could skip a write that is still needed
+        field_def = self.field_registry.by_name(field_name)
+        if field_def:
+            field_name = field_def['name']
+        apps = self.iter_apps(self.field_search([field_name], [value]), per_page=100, fresh=True)
+        return {str(app['id']) for app in apps}
+
+    def find_app_by_field(self, field_name=None, field_value=None, page=None, minimal=False):
+        return list(self.iter_apps(self.field_search(field_name, field_value), per_page=100, page=page,
+                                   minimal=minimal))
 
     def find_app_by_category(self, category):
-        search = {"search": [{"property": "category", "op": "=", "value": category}],
-                  "filters": [],
-                  "sorting": {"property": "account_count", "direction": "desc"}}
-        return self._find_app(search=search)
-    def find_app(self, app_name, page=None, exact=False):
-        is_domain = _is_domain(app_name)
-        app_name = _transform_app_name(app_name)
-        # {"search":[{"field":"service_info.name","op":"ilike","value":"%Zoom%"},{"field":"service_info.category.name","op":"ilike","value":"%Zoom%"}],"filters":[],"page":1,"per_page":50,"sort":"account_count","sort_dir":"desc"}
-        if exact:
-            op = "="
-            val = f"{app_name}"
-        else:
-            op = "ilike"
-            val = f"%{app_name}%"
-        search = {"search": [],
-                  "filters": [],
-                  "sorting": {"property": "account_count", "direction": "desc"}}
-        if is_domain:
-            search['search'].append({"property": "domain_canonical", "op": op, "value": val})
-        else:
-            search['search'].append({"property": "service_info.name", "op": op, "value": val})
-            search['search'].append({"property": "name", "op": op, "value": val})
+        return list(self.iter_apps(self.category_search(category)))
+
+    def find_app(self, app_name, page=None, exact=False, minimal=False):
+        if self.inventory and not page:
+            # the local snapshot answers most lookups, only a miss goes to the API
+            apps = self.inventory.find(app_name, exact=exact)
+            if apps:
+                return apps
+        return list(self.iter_apps(self.app_search(app_name, exact=exact), page=page, minimal=minimal))
+
+    def _search_page(self, api, kind, search, page, per_page):
+        # a kind of None bypasses the response cache
+        if kind is None:
+            return self.post(api, dict(search, page=page, per_page=per_page))
+        return self.cached_post(kind, api, dict(search, page=page, per_page=per_page))
+
+    def _iter_pages(self, api, kind, search, per_page=50, page=None, prefetch=False, workers=1):
+        response = self._search_page(api, kind, search, page if page else 1, per_page)
+        last_page = _last_page(response, per_page)
+        if workers > 1 and last_page and response['next_page']:
+            yield response['values']
+            yield from self._fetch_pages(api, kind, search, per_page, response['next_page'], last_page, workers)
+            return
+        if not prefetch:
+            while True:
+                yield response['values']
+                if not response['next_page']:
+                    return
+                response = self._search_page(api, kind, search, response['next_page'], per_page)
+        # fetch the next page in the background while the caller consumes the current one
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                pending = None
+                if response['next_page']:
+                    pending = executor.submit(self._search_page, api, kind, search, response['next_page'], per_page)
+                yield response['values']
+                if not pending:
+                    return
+                response = pending.result()
 
-        return self._find_app(search)
+    def _fetch_pages(self, api, kind, search, per_page, first_page, last_page, workers):
+        # pages come back in page order so the sorting is preserved
+        return bounded_map(lambda page: self._search_page(api, kind, search, page, per_page)['values'],
+                           range(first_page, last_page + 1), workers)
 
-    def _find_app(self, search, page=None):
-        search["page"] = 1 if not page else page
-        search["per_page"] = 50
-        response = self.post("/apps/search", search)
-        ret = response['values']
-        if response['next_page']:
-            ret.extend(self._find_app(search=search, page=response['next_page']))
-        return ret
+    def iter_app_pages(self, search, per_page=50, page=None, prefetch=False, workers=1, minimal=False,
+                       fresh=False):
+        # apps come back as App records, minimal strips them to AppSummary records on arrival; the properties
+        # projection is not documented by the API so it is only sent when project_apps opts in
+        if minimal and self.project_apps:
+            search = dict(search, properties=list(APP_SUMMARY_PROPERTIES))
+        pages = self._iter_pages("/apps/search", None if fresh else 'apps', search, per_page=per_page, page=page,
+                                 prefetch=prefetch, workers=workers)
+        record = AppSummary.from_json if minimal else App.from_json
+        return ([record(app) for app in values] for values in pages)
+
+    def iter_apps(self, search, per_page=50, page=None, prefetch=False, workers=1, minimal=False, fresh=False):
+        for values in self.iter_app_pages(search, per_page=per_page, page=page, prefetch=prefetch, workers=workers,
+                                          minimal=minimal, fresh=fresh):
+            yield from values
 
     def find_field(self, field_name, field_identifier=None):
-        fields = self.list_fields()
-        for field_def in fields:
-            if field_identifier and str(field_def['id']) == field_identifier:
+        if field_identifier:
+            field_def = self.field_registry.by_id(field_identifier)
+            if field_def:
                 return field_def
-            if field_def['name'] == field_name:
+        if field_name:
+            field_def = self.field_registry.by_name(field_name)
+            if field_def and field_def['name'] == field_name:
                 return field_def
         return None
 
@@ -163,10 +506,11 @@ class NudgeClient:
             "field_type": field_type.upper(),
             "scopes": [field_s.lower() for field_s in field_scope]
         }
-        response = self.post('/fields', body=body)
+        response = self.post('/fields', body=body, idempotent=False)
+        self._reset_fields()
         field_id = response['id']
-        for value in allowed_values:
-            self.update_field(field_identifier=field_id, allowed_values=value)
+        if allowed_values:
+            self.update_field(field_identifier=field_id, allowed_values=allowed_values)
 
     def update_field(self, field_identifier, field_name=None, allowed_values=None, field_scope=None):
         body = {}
@@ -178,13 +522,22 @@ class NudgeClient:
         if allowed_values:
             for value in allowed_values:
                 if not self.value_exists(field_identifier, value):
-                    self.post(f'/fields/{field_identifier}/allowed_values', body={
+                    response = self.post(f'/fields/{field_identifier}/allowed_values', body={
                         "value": value
-                    })
+                    }, idempotent=False)
+                    # keep the registry current so repeated values are not posted twice
+                    allowed_value = response if isinstance(response, dict) and 'value' in response else {"value": value}
+                    self.field_registry.add_allowed_value(field_identifier, allowed_value)
+        if body:
+            self._reset_fields()
+        else:
+            self._invalidate('fields')
 
     def get_supply_chain(self, canonical_domain):
         return self.get(f'/api/service/vendors/{canonical_domain}')['vendors']
 
-    def get_service_info(self, canonical_domain):
+    def get_service_info(self, canonical_domain, max_age=None):
+        if max_age:
+            return self.cached_get('service', f'/api/service/details/{canonical_domain}', max_age)
         return self.get(f'/api/service/details/{canonical_domain}')
 
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from click import ClickException
+
+RETRYABLE_STATUS = (429, 502, 503, 504)
+
+
+class DeadlineExceeded(ClickException):
+    # the run is out of time, callers that collect per item errors let this one through to stop the command
+    pass
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    # full jitter: spread retries of concurrent workers instead of retrying in lock step
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RequestCounters:
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.throttled = 0
+        self.hedged = 0
+        self.hedges_won = 0
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        return {"requests": self.requests, "retried": self.retried, "throttled": self.throttled,
+                "hedged": self.hedged, "hedges_won": self.hedges_won}
+
+
+class RateLimiter:
+    # token bucket shared by every request of a client, a throttled response halves the rate at most once per
+    # window and every success adds `increase` back; a rate of None still honors Retry-After pauses
+
+    def __init__(self, rate=None, burst=None, min_rate=0.5, increase=0.1, window=1.0) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.increase = increase
+        self.capacity = burst if burst else max(1.0, float(rate or 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.window = window
+        self.decreased_at = None
+
+    def acquire(self):
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def reserve(self):
+        # takes a token and returns 0, or returns the seconds to wait before trying again; the asyncio
+        # client awaits the wait instead of blocking the event loop
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.paused_until and (not self.rate or self.tokens >= 1):
+                if self.rate:
+                    self.tokens -= 1
+                return 0
+            wait = self.paused_until - now
+            if self.rate:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            return wait
+
+    def on_success(self):
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            if self.rate:
+                self._refill(now)
+                if self.decreased_at is None or now - self.decreased_at >= max(self.window, 1 / self.rate):
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self.decreased_at = now
+                self.tokens = 0
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
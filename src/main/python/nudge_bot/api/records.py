@@ -0,0 +1,128 @@
+# properties of an app requested by searches that only list or resolve apps
+APP_SUMMARY_PROPERTIES = ("id", "name", "account_count", "domain_canonical", "service_info.name",
+                          "service_info.service_canonical_domain")
+
+_ITEM_KEYS = frozenset(("id", "name", "account_count", "domain_canonical"))
+
+
+class AppSummary:
+    # an app search hit with only what listing and resolution need, full apps are most of a sweep's memory
+
+    __slots__ = ("id", "name", "account_count", "domain_canonical", "service_name", "canonical_domain")
+
+    def __init__(self, id, name, account_count=None, domain_canonical=None, service_name=None,
+                 canonical_domain=None) -> None:
+        self.id = id
+        self.name = name
+        self.account_count = account_count
+        self.domain_canonical = domain_canonical
+        self.service_name = service_name
+        self.canonical_domain = canonical_domain
+
+    @classmethod
+    def from_json(cls, app):
+        service_info = app.get('service_info') or {}
+        return cls(app['id'], app.get('name'), app.get('account_count'), app.get('domain_canonical'),
+                   service_info.get('name'), service_info.get('service_canonical_domain'))
+
+    def __getitem__(self, key):
+        # keeps app['id'] style call sites working on both summaries and full app dicts
+        if key in _ITEM_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in _ITEM_KEYS else default
+
+    def __repr__(self):
+        return f"AppSummary(id={self.id!r}, name={self.name!r})"
+
+
+class Field:
+    # shared by every app set to the field
+
+    __slots__ = ("id", "name")
+
+    def __init__(self, id, name) -> None:
+        self.id = id
+        self.name = name
+
+    def __repr__(self):
+        return f"Field(id={self.id!r}, name={self.name!r})"
+
+
+class AllowedValue:
+
+    __slots__ = ("id", "value")
+
+    def __init__(self, id, value) -> None:
+        self.id = id
+        self.value = value
+
+    def __repr__(self):
+        return f"AllowedValue(id={self.id!r}, value={self.value!r})"
+
+
+# a tenant has a few dozen fields and values repeated across thousands of apps, so they are interned
+_fields = {}
+_allowed_values = {}
+
+
+def _field(field):
+    key = (field.get('id'), field.get('name'))
+    ref = _fields.get(key)
+    if ref is None:
+        ref = _fields.setdefault(key, Field(*key))
+    return ref
+
+
+def _allowed_value(allowed_value):
+    key = (allowed_value.get('id'), allowed_value.get('value'))
+    ref = _allowed_values.get(key)
+    if ref is None:
+        ref = _allowed_values.setdefault(key, AllowedValue(*key))
+    return ref
+
+
+class App(AppSummary):
+    # the summary plus category, account counter and (Field, AllowedValue) pairs in the order the API returned
+
+    __slots__ = ("category", "total_accounts", "fields")
+
+    def __init__(self, id, name, account_count=None, domain_canonical=None, service_name=None,
+                 canonical_domain=None, category=None, total_accounts=None, fields=()) -> None:
+        super().__init__(id, name, account_count, domain_canonical, service_name, canonical_domain)
+        self.category = category
+        self.total_accounts = total_accounts
+        self.fields = fields
+
+    @classmethod
+    def from_json(cls, app):
+        if isinstance(app, App):
+            return app
+        service_info = app.get('service_info') or {}
+        category = service_info.get('category') or {}
+        counters = app.get('counters') or {}
+        fields = tuple((_field(entry.get('field') or {}), _allowed_value(entry.get('allowed_value') or {}))
+                       for entry in app.get('fields') or ())
+        return cls(app['id'], app.get('name'), app.get('account_count'), app.get('domain_canonical'),
+                   service_info.get('name'), service_info.get('service_canonical_domain'), category.get('name'),
+                   counters.get('total_accounts'), fields)
+
+    def to_json(self):
+        # the API shape, restricted to what the record holds
+        return {
+            "id": self.id,
+            "name": self.name,
+            "account_count": self.account_count,
+            "domain_canonical": self.domain_canonical,
+            "service_info": {"name": self.service_name, "service_canonical_domain": self.canonical_domain,
+                             "category": {"name": self.category}},
+            "counters": {"total_accounts": self.total_accounts},
+            "fields": [{"field": {"id": field.id, "name": field.name},
+                        "allowed_value": {"id": allowed_value.id, "value": allowed_value.value}}
+                       for field, allowed_value in self.fields],
+        }
+
+    def __repr__(self):
+        return f"App(id={self.id!r}, name={self.name!r})"
@@ -0,0 +1,153 @@
+import json
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_ID_SEGMENT = re.compile(r'^(\d+|[0-9a-f]{8}-[0-9a-f-]{27})$', re.IGNORECASE)
+_DOMAIN_APIS = ('/api/service/vendors/', '/api/service/details/')
+
+
+def endpoint_name(method, api):
+    # ids and domains are folded so every app or service shares one endpoint line
+    api = api.split('?')[0]
+    for prefix in _DOMAIN_APIS:
+        if api.startswith(prefix):
+            return f"{method} {prefix}{{domain}}"
+    segments = ['{id}' if _ID_SEGMENT.match(segment) else segment for segment in api.split('/')]
+    return f"{method} {'/'.join(segments)}"
+
+
+def percentile(ordered, percent):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class EndpointStats:
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.latencies = []
+        self.statuses = Counter()
+        self.bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, status, size, elapsed):
+        self.latencies.append(elapsed)
+        self.statuses[status] += 1
+        self.bytes += size
+        self.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        statuses = sorted(self.statuses.items(), key=lambda item: str(item[0]))
+        return {"calls": len(ordered), "bytes": self.bytes,
+                "statuses": {str(status): count for status, count in statuses},
+                "p50": percentile(ordered, 50), "p95": percentile(ordered, 95), "p99": percentile(ordered, 99),
+                "total": sum(ordered)}
+
+
+class RequestStats:
+    # network time is the wall time with at least one request in flight, parallel requests are not counted twice
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.endpoints = {}
+        self.network_time = 0.0
+        self._in_flight = 0
+        self._busy_since = None
+
+    def request_started(self):
+        with self._lock:
+            if self._in_flight == 0:
+                self._busy_since = time.perf_counter()
+            self._in_flight += 1
+
+    def request_finished(self, method, api, status, size, elapsed):
+        name = endpoint_name(method, api)
+        with self._lock:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self.network_time += time.perf_counter() - self._busy_since
+            endpoint = self.endpoints.get(name)
+            if endpoint is None:
+                endpoint = self.endpoints[name] = EndpointStats()
+            endpoint.record(status, size, elapsed)
+
+    def summary(self, counters=None):
+        with self._lock:
+            wall_time = time.perf_counter() - self.started
+            network_time = self.network_time
+            if self._in_flight:
+                network_time += time.perf_counter() - self._busy_since
+            endpoints = {name: endpoint.summary() for name, endpoint in sorted(self.endpoints.items())}
+        summary = {"wall_time": wall_time, "network_time": network_time,
+                   "local_time": max(0.0, wall_time - network_time),
+                   "calls": sum(endpoint['calls'] for endpoint in endpoints.values()),
+                   "endpoints": endpoints}
+        if counters:
+            summary.update(counters.as_dict())
+        return summary
+
+    def format_text(self, counters=None):
+        summary = self.summary(counters)
+        lines = [f"{'endpoint':<45} {'calls':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'KiB':>9}"]
+        for name, endpoint in summary['endpoints'].items():
+            lines.append(f"{name:<45} {endpoint['calls']:>7} {endpoint['p50'] * 1000:>8.1f} "
+                         f"{endpoint['p95'] * 1000:>8.1f} {endpoint['p99'] * 1000:>8.1f} "
+                         f"{endpoint['bytes'] / 1024:>9.1f}")
+        lines.append(f"{summary['calls']} calls in {summary['wall_time']:.2f}s "
+                     f"(network {summary['network_time']:.2f}s, local {summary['local_time']:.2f}s)")
+        if counters:
+            lines.append(f"{summary['retried']} retried, {summary['throttled']} throttled, "
+                         f"{summary['hedged']} hedged ({summary['hedges_won']} won)")
+        return "\n".join(lines)
+
+    def format_json(self, counters=None):
+        return json.dumps(self.summary(counters), indent=2)
+
+    def format_openmetrics(self, counters=None):
+        with self._lock:
+            endpoints = {name: (list(endpoint.buckets), sum(endpoint.latencies), len(endpoint.latencies),
+                                endpoint.bytes, dict(endpoint.statuses))
+                         for name, endpoint in sorted(self.endpoints.items())}
+        summary = self.summary(counters)
+        lines = ["# TYPE nudge_request_duration_seconds histogram",
+                 "# UNIT nudge_request_duration_seconds seconds"]
+        for name, (buckets, total, count, _, _) in endpoints.items():
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += bucket
+                lines.append(f'nudge_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'nudge_request_duration_seconds_count{{endpoint="{name}"}} {count}')
+            lines.append(f'nudge_request_duration_seconds_sum{{endpoint="{name}"}} {total}')
+        lines.append("# TYPE nudge_requests counter")
+        for name, (_, _, _, _, statuses) in endpoints.items():
+            for status, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+                lines.append(f'nudge_requests_total{{endpoint="{name}",status="{status}"}} {count}')
+        lines.append("# TYPE nudge_response_bytes counter")
+        for name, (_, _, _, size, _) in endpoints.items():
+            lines.append(f'nudge_response_bytes_total{{endpoint="{name}"}} {size}')
+        for metric in ('wall_time', 'network_time', 'local_time'):
+            lines.append(f"# TYPE nudge_{metric}_seconds gauge")
+            lines.append(f"nudge_{metric}_seconds {summary[metric]}")
+        if counters:
+            for metric in ('retried', 'throttled', 'hedged', 'hedges_won'):
+                lines.append(f"# TYPE nudge_{metric} counter")
+                lines.append(f"nudge_{metric}_total {summary[metric]}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def format(self, output_format, counters=None):
+        if output_format == 'JSON':
+            return self.format_json(counters)
+        if output_format == 'OpenMetrics':
+            return self.format_openmetrics(counters)
+        return self.format_text(counters)
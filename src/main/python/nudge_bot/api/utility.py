@@ -1,11 +1,15 @@
+import asyncio
 import enum
-from collections import defaultdict
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
 
 import click
 import pydash
 
-from nudge_bot.api.nudge import NudgeClient
+from nudge_bot.api.async_nudge import AsyncNudgeClient, run_with_client
+from nudge_bot.api.nudge import NudgeClient, search_key
+from nudge_bot.api.records import App, AppSummary
 
 
 def print_app(app):
@@ -13,12 +17,17 @@ def print_app(app):
 
 
 def get_app_name(app):
-    name_ = app['service_info']['name'] if app['service_info']['name'] else app['name']
+    if isinstance(app, AppSummary):
+        name_ = app.service_name if app.service_name else app.name
+    else:
+        name_ = app['service_info']['name'] if app['service_info']['name'] else app['name']
     return name_.replace(',', '')
 
 
 def get_canonical_domain(app):
-    return pydash.get(app, 'service_info.service_canonical_domain')
+    if isinstance(app, AppSummary):
+        return app.canonical_domain
+    return _get_canonical_domain(app)
 
 
 class ResolutionStatus(enum.Enum):
@@ -60,24 +69,78 @@ class AppResolution:
 
 class AppResolutionCollection:
 
-    def __init__(self) -> None:
+    def __init__(self, keep=None) -> None:
         super().__init__()
         self.resolutions = defaultdict(list)
+        self.counts = Counter()
+        # statuses whose resolutions are retained, the others are only counted
+        self.keep = keep
 
     def add(self, app_resolution: AppResolution):
-        self.resolutions[app_resolution.status].append(app_resolution)
+        self.counts[app_resolution.status] += 1
+        if self.keep is None or app_resolution.status in self.keep:
+            self.resolutions[app_resolution.status].append(app_resolution)
 
     def get(self, status: ResolutionStatus) -> List[AppResolution]:
         return self.resolutions[status]
 
     def count(self, status: ResolutionStatus) -> int:
-        return len(self.get(status))
-
-
-def resolve_app(app_name, nudge_client: NudgeClient, interactive=False) -> AppResolution:
-    apps = nudge_client.find_app(app_name=app_name)
+        return self.counts[status]
+
+
+def chunks(entries, size):
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def find_apps(app_names, nudge_client: NudgeClient, workers=8, on_found=None):
+    unique = {}
+    for app_name in app_names:
+        unique.setdefault(search_key(app_name), app_name)
+    if nudge_client.use_async:
+        return _find_apps_async(unique, nudge_client, workers, on_found)
+    found = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(nudge_client.find_app, app_name, minimal=True): key
+                   for key, app_name in unique.items()}
+        for future in as_completed(futures):
+            found[futures[future]] = future.result()
+            if on_found:
+                on_found()
+    return found
+
+
+def _find_apps_async(unique, nudge_client: NudgeClient, workers, on_found):
+    async def find(client: AsyncNudgeClient, key, app_name):
+        apps = nudge_client.inventory.find(app_name) if nudge_client.inventory else None
+        if not apps:
+            apps = await client.find_app(app_name, minimal=True)
+        if on_found:
+            on_found()
+        return key, apps
+
+    async def find_all(client: AsyncNudgeClient):
+        return dict(await asyncio.gather(*(find(client, key, app_name) for key, app_name in unique.items())))
+
+    return run_with_client(nudge_client, find_all, concurrency=workers)
+
+
+def resolve_app(app_name, nudge_client: NudgeClient, interactive=False, apps=None) -> AppResolution:
+    if apps is None:
+        apps = nudge_client.find_app(app_name=app_name, minimal=True)
     if not apps or len(apps) == 0:
         if interactive:
+            if nudge_client.inventory:
+                similar = nudge_client.inventory.find_similar(app_name)
+                if len(similar) > 0:
+                    click.secho(f"\nSimilar apps to {app_name}: {', '.join(get_app_name(app) for app in similar)}",
+                                fg='blue')
             if click.confirm(f"\nUnable to find app {app_name}, would you like to enter a new search?"):
                 new_search = click.prompt(f"Please enter new search for {app_name}", type=str)
                 return resolve_app(new_search, nudge_client, interactive=interactive)
@@ -111,27 +174,71 @@ def resolve_app(app_name, nudge_client: NudgeClient, interactive=False) -> AppRe
     return AppResolution(status=ResolutionStatus.RESOLVED, app_name=app_name, app=app)
 
 
-def _get_field_value(name, fields_):
-    found_fields = pydash.filter_(fields_, lambda x: pydash.get(x, 'field.name') == name)
-    if len(found_fields) > 0:
-        return ":".join(pydash.flat_map(found_fields, lambda x: pydash.get(x, 'allowed_value.value')))
+def _path(*keys):
+    # precompiled equivalent of pydash.get for a fixed dotted path
+    def get(value):
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return get
+
+
+_get_canonical_domain = _path('service_info', 'service_canonical_domain')
+_get_category = _path('service_info', 'category', 'name')
+_get_account_count = _path('counters', 'total_accounts')
+
+
+def index_field_values(app):
+    values = defaultdict(list)
+    if isinstance(app, App):
+        for field, allowed_value in app.fields:
+            values[field.name].append(allowed_value.value)
+        return values
+    for field in app.get('fields') or []:
+        field_def = field.get('field') or {}
+        allowed_value = field.get('allowed_value') or {}
+        values[field_def.get('name')].append(allowed_value.get('value'))
+    return values
+
+
+def _get_field_value(name, field_values):
+    if name in field_values:
+        return ":".join(value for value in field_values[name] if value is not None)
     return 'Not Set'
 
 
 def get_fields(value, field_names):
-    fields_ = value['fields']
-    ret = []
-    for name in field_names:
-        ret.append(_get_field_value(name, fields_))
-    return ret
+    field_values = index_field_values(value)
+    return [_get_field_value(name, field_values) for name in field_names]
 
 
 def get_category(app):
-    return pydash.get(app, 'service_info.category.name')
+    if isinstance(app, App):
+        return app.category
+    return _get_category(app)
 
 
 def get_account_count(app):
-    return pydash.get(app, 'counters.total_accounts')
+    if isinstance(app, App):
+        return app.total_accounts
+    return _get_account_count(app)
+
+
+class AppRowFormatter:
+
+    def __init__(self, field_names) -> None:
+        super().__init__()
+        self.field_names = list(field_names)
+
+    def header(self):
+        return ["App", " Category", " Accounts"] + self.field_names
+
+    def row(self, app):
+        field_values = index_field_values(app)
+        return [get_app_name(app), str(get_category(app)), str(get_account_count(app))] + \
+            [_get_field_value(name, field_values) for name in self.field_names]
 
 
 def _extract_scopes(x):
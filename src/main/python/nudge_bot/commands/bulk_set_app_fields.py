@@ -1,18 +1,135 @@
-
+import itertools
 
 import click
 from click import ClickException, progressbar
 
 from nudge_bot.api import nudge, utility
+from nudge_bot.api.concurrency import bounded_map
+from nudge_bot.api.journal import WriteJournal, default_journal_path
 from nudge_bot.api.nudge import NudgeClient
+from nudge_bot.api.rate_limit import DeadlineExceeded
 from nudge_bot.main import cli
 
 
-def _is_app_names(lines):
-    for line in lines:
-        if not line[0].isdigit():
-            return True
-    return False
+def _read_rows(to_read):
+    for line in to_read:
+        line = line.strip()
+        if line:
+            yield line.split(',')
+
+
+def _parse_update(nudge_client: NudgeClient, meta, field, field_id, value, dynamic_values):
+    if len(meta) > 3:
+        raise ClickException(f"Entry found with too many values {meta}")
+    if len(meta) < 2:
+        raise ClickException(f"Entry found without all values {meta}")
+    id = meta[0].strip()
+    name = meta[1]
+    if not id.isdigit():
+        raise ClickException(f"Entry found with an app name instead of an app id {meta},"
+                             f" use the 'transform-app-list' command to fix")
+    if dynamic_values:
+        if len(meta) != 3:
+            raise ClickException(f"Entry found without all values {meta}")
+        value = meta[2].strip()
+        field_id = nudge_client.get_ids_for_field(field, value)
+    return id, name, field_id, value
+
+
+def _iter_updates(nudge_client: NudgeClient, rows, field, field_id, value, dynamic_values):
+    # a malformed row is reported with the failures instead of stopping the rows that follow
+    for meta in rows:
+        try:
+            yield meta, _parse_update(nudge_client, meta, field, field_id, value, dynamic_values), None
+        except DeadlineExceeded:
+            raise
+        except ClickException as e:
+            yield meta, None, e.format_message()
+
+
+def _skip_applied(updates, journal: WriteJournal):
+    for meta, update, error in updates:
+        if error is None:
+            app_id, name, field_id, value = update
+            if journal.is_applied(app_id, field_id, value):
+                journal.skipped += 1
+                continue
+        yield meta, update, error
+
+
+class _CurrentValues:
+
+    def __init__(self, nudge_client: NudgeClient, field) -> None:
+        super().__init__()
+        self.nudge_client = nudge_client
+        self.field = field
+        self.unchanged = 0
+        # one search per distinct value gives every app that already has it, read from the live API since
+        # a stale snapshot or cached search would skip writes that are still needed
+        self._apps_by_value = {}
+
+    def has_value(self, app_id, value):
+        key = value.casefold()
+        if key not in self._apps_by_value:
+            self._apps_by_value[key] = self.nudge_client.app_ids_with_field_value(self.field, value)
+        return app_id.strip() in self._apps_by_value[key]
+
+
+def _skip_unchanged(updates, current_values: _CurrentValues):
+    for meta, update, error in updates:
+        if error is None:
+            app_id, name, field_id, value = update
+            if current_values.has_value(app_id, value):
+                current_values.unchanged += 1
+                continue
+        yield meta, update, error
+
+
+def _set_app_field(nudge_client: NudgeClient, app_id, field_id, value):
+    try:
+        nudge_client.set_app_field(app_id, field_id, value)
+        return None
+    except DeadlineExceeded:
+        raise
+    except ClickException as e:
+        return e.format_message()
+    except Exception as e:
+        return str(e)
+
+
+def _apply_update(nudge_client: NudgeClient, entry):
+    meta, update, error = entry
+    if error is None:
+        app_id, name, field_id, value = update
+        error = _set_app_field(nudge_client, app_id, field_id, value)
+    return meta, update, error
+
+
+def _apply_updates(nudge_client: NudgeClient, updates, concurrency):
+    if concurrency <= 1:
+        return (_apply_update(nudge_client, entry) for entry in updates)
+    # a bounded window of in-flight writes keeps memory flat and hands results back in input order
+    return bounded_map(lambda entry: _apply_update(nudge_client, entry), updates, concurrency,
+                       window=concurrency * 2)
+
+
+def _apply_bulk_updates(nudge_client: NudgeClient, updates, endpoint, concurrency):
+    writes = []
+    for meta, update, error in updates:
+        if error is not None:
+            yield meta, update, error
+            continue
+        app_id, name, field_id, value = update
+        writes.append(((meta, update), app_id, field_id, value))
+        if len(writes) >= 1000:
+            yield from _write_bulk(nudge_client, writes, endpoint, concurrency)
+            writes = []
+    yield from _write_bulk(nudge_client, writes, endpoint, concurrency)
+
+
+def _write_bulk(nudge_client: NudgeClient, writes, endpoint, concurrency):
+    for (meta, update), error in nudge_client.set_app_fields(writes, endpoint, workers=concurrency):
+        yield meta, update, error
 
 
 @cli.command(name='bulk-set-app-field',short_help="Set a field for list of apps")
@@ -21,40 +138,90 @@ def _is_app_names(lines):
 @click.option('--dry-run',     help='Just print the apps to be updated' , is_flag=True)
 @click.option('--app-list',     help='A line delimited list of apps ids to set the field', type=click.File('r'))
 @click.option('--app-value-list',     help='A line delimited list of apps ids and values to set the field', type=click.File('r'))
+@click.option('--concurrency',     help='Number of updates to send in parallel', type=click.IntRange(min=1), default=1)
+@click.option('--journal',     help='File recording completed updates, used by --resume',
+              type=click.Path(dir_okay=False))
+@click.option('--resume',
+              help='Skip updates already recorded in the journal (defaults to the list name with .journal)',
+              is_flag=True)
+@click.option('--skip-unchanged', help='Only send updates for apps that do not already have the value',
+              is_flag=True)
+@click.option('--bulk',     help='Group updates by value and send them in batches to --bulk-endpoint', is_flag=True)
+@click.option('--bulk-endpoint', envvar='NUDGE_BULK_ENDPOINT',
+              help='Path of the batch write, {field_id} is replaced, e.g. /fields/{field_id}/apps. It must take '
+                   '{"value", "app_ids"} and answer {"updated": <count>}')
 @click.pass_obj
-def list_fields(nudge_client:NudgeClient, field, value, app_list,app_value_list, dry_run):
+def list_fields(nudge_client:NudgeClient, field, value, app_list,app_value_list, dry_run, concurrency, journal, resume,
+                skip_unchanged, bulk, bulk_endpoint):
     if app_list and app_value_list:
         raise ClickException("Only one of --app-list or --app-value-list may be provided")
     if not app_list and not app_value_list:
         raise ClickException("At least one of --app-list or --app-value-list must be provided")
     if app_list and not value:
         raise ClickException("When using --app-list a --value must be provided")
+    if bulk and not bulk_endpoint:
+        raise ClickException("--bulk requires --bulk-endpoint (or NUDGE_BULK_ENDPOINT)")
+    if nudge_client.use_async:
+        # writes go through the journal and bulk writer of the synchronous client, use --concurrency instead
+        raise ClickException("--async-io is not supported by bulk-set-app-field, use --concurrency")
     dynamic_values = app_value_list is not None
     to_read = app_list if app_list else app_value_list
 
     # do this to verify we can find the right field and value
     field_id = nudge_client.get_ids_for_field(field, value)
-    lines = []
-    for line in to_read.readlines():
-        lines.append(line.strip().split(','))
-    if _is_app_names(lines):
-        raise ClickException("The app list appears to be names instead of app"
-                             " ids use the 'transform-app-list' command to fix")
-
-    with progressbar(lines) as apps:
-        for meta in apps:
-            if len(meta) > 3:
-                raise ClickException(f"Entry found with too many values {meta}")
-            id = meta[0]
-            name = meta[1]
-            if dynamic_values:
-                if len(meta) != 3:
-                    raise ClickException(f"Entry found without all values {meta}")
-                value = meta[2].strip()
-                field_id = nudge_client.get_ids_for_field(field, value)
-
-            if dry_run:
+    rows = _read_rows(to_read)
+    first = next(rows, None)
+    if first is None:
+        raise ClickException("The app list is empty")
+    updates = _iter_updates(nudge_client, itertools.chain([first], rows), field, field_id, value, dynamic_values)
+    current_values = None
+    if skip_unchanged:
+        current_values = _CurrentValues(nudge_client, field)
+        updates = _skip_unchanged(updates, current_values)
+
+    if dry_run:
+        count = 0
+        for meta, update, error in updates:
+            count += 1
+            if error is None:
+                id, name, field_id, value = update
                 click.secho(f"Updating: {name}  to {field} : {value}")
             else:
-                nudge_client.set_app_field(id, field_id, value)
-    click.secho(f"Finished updating {len(lines)}")
+                click.secho(f"Skipping: {error}", fg='red')
+        if current_values:
+            click.secho(f"Unchanged {current_values.unchanged}")
+        click.secho(f"Finished updating {count}")
+        return
+
+    # a journal is only kept when asked for, --resume alone reads and extends the one next to the list
+    journal_path = journal if journal else (default_journal_path(to_read.name) if resume else None)
+    if resume and journal_path is None:
+        raise ClickException("Resuming an app list read from stdin requires --journal")
+    count = 0
+    failures = []
+    with WriteJournal(journal_path, resume=resume) as write_journal:
+        updates = _skip_applied(updates, write_journal)
+        applied = _apply_bulk_updates(nudge_client, updates, bulk_endpoint, concurrency) if bulk \
+            else _apply_updates(nudge_client, updates, concurrency)
+        with progressbar(applied) as results:
+            for meta, update, error in results:
+                count += 1
+                if error is not None:
+                    failures.append((meta, error))
+                else:
+                    app_id, name, field_id, value = update
+                    write_journal.record(app_id, field_id, value)
+    if write_journal.skipped > 0:
+        click.secho(f"Skipped {write_journal.skipped} updates already applied")
+    if current_values:
+        click.secho(f"Unchanged {current_values.unchanged}, changed {count - len(failures)}, "
+                    f"failed {len(failures)}")
+    click.secho(f"Finished updating {count - len(failures)}")
+    if nudge_client.counters.retried > 0:
+        click.secho(f"Retried {nudge_client.counters.retried} requests "
+                    f"({nudge_client.counters.throttled} throttled)", fg='yellow')
+    if len(failures) > 0:
+        click.secho(f"Failed to update {len(failures)} apps", fg='red')
+        for meta, error in failures:
+            click.secho(f"\t{','.join(meta)}: {error}")
+        raise ClickException(f"Failed to update {len(failures)} of {count} apps")
@@ -1,3 +1,5 @@
+import csv
+
 import click
 from click import ClickException
 
@@ -12,40 +14,53 @@ from nudge_bot.main import cli
 @click.option('--field-name', help='The field name to search (optional)', multiple=True)
 @click.option('--field-value', help="The field value to search (use \'None\' to search for unset fields)",
               multiple=True)
+@click.option('--all-apps', help='List every app', is_flag=True)
 @click.option('--output-to-file', help='Use this flag print to file', is_flag=True)
 @click.option('--output-format', help='The output format', type=click.Choice(['Id', 'CSV']), default='CSV')
 @click.option('--output-file', help='The file to write the search results', type=click.File('w'),
               default="search_list.csv")
+@click.option('--prefetch', help='Fetch the next page of results while the current one is written', is_flag=True)
+@click.option('--per-page', help='The number of apps requested per page', type=click.IntRange(1, 1000))
+@click.option('--page-workers', help='Number of pages fetched in parallel once the result count is known',
+              type=click.IntRange(min=1), default=1)
 @click.pass_obj
-def search_app(nudge_client: NudgeClient, app_name,category, field_name, field_value, output_to_file, output_file,
-                output_format):
+def search_app(nudge_client: NudgeClient, app_name,category, field_name, field_value, all_apps, output_to_file,
+               output_file, output_format, prefetch, per_page, page_workers):
     if len(field_name) != len(field_value):
         raise ClickException("Please provide values for every field to search, use \'None\' to search for unset fields")
     if app_name:
-        values = nudge_client.find_app(app_name)
+        search = nudge_client.app_search(app_name)
     elif category:
-        values = nudge_client.find_app_by_category(category)
+        search = nudge_client.category_search(category)
     elif len(field_name) > 0:
-        values = nudge_client.find_app_by_field(field_name, field_value)
+        search = nudge_client.field_search(field_name, field_value)
+        per_page = per_page if per_page else 100
+    elif all_apps:
+        search = {"search": [], "filters": []}
+        per_page = per_page if per_page else 100
     else:
-        raise ClickException("Must provide either --app-name or --field-name")
-    if len(values) == 0:
+        raise ClickException("Must provide one of --app-name, --category, --field-name or --all-apps")
+    writer = csv.writer(output_file, lineterminator='\n') if output_to_file and output_format == 'CSV' else None
+    values = nudge_client.inventory.find(app_name) if app_name and nudge_client.inventory else None
+    if not values:
+        # without a CSV to write only the id, name and account count of each app are needed
+        values = nudge_client.iter_apps(search, per_page=per_page if per_page else 50, prefetch=prefetch,
+                                        workers=page_workers, minimal=writer is None)
+    formatter = None
+    count = 0
+    for value in values:
+        if writer and formatter is None:
+            # only look up the fields once we know there is something to write
+            formatter = utility.AppRowFormatter(utility.get_field_names(nudge_client.list_fields(), 'SaaS'))
+            writer.writerow(formatter.header())
+        count += 1
+        click.secho(utility.print_app(value))
+        if writer:
+            writer.writerow(formatter.row(value))
+        elif output_to_file:
+            output_file.write(f"{value['id']}\n")
+    if count == 0:
         if app_name:
             click.secho(f"No apps found for name: {app_name}", fg='red')
         else:
-            click.secho(f"No apps found for field: {field_name} value: {values}", fg='red')
-    else:
-        fields = nudge_client.list_fields()
-        field_names = utility.get_field_names(fields, 'SaaS')
-        if output_to_file:
-            if output_format == 'CSV':
-                output_file.writelines(f"App, Category, Accounts,{','.join(field_names)}\n")
-
-        for value in values:
-            click.secho(utility.print_app(value))
-            if output_to_file:
-                if output_format == 'Id':
-                    out = f"{value['id']}\n"
-                else:
-                    out = f"{utility.get_app_name(value)},{utility.get_category(value)},{utility.get_account_count(value)},{','.join(utility.get_fields(value, field_names))}\n"
-                output_file.writelines(out)
+            click.secho(f"No apps found for field: {field_name} value: {field_value}", fg='red')
@@ -1,18 +1,134 @@
+import asyncio
 import json
 
 import click
-from click import ClickException
+from click import ClickException, progressbar
 
 from nudge_bot.api import nudge, utility
+from nudge_bot.api.async_nudge import run_with_client
+from nudge_bot.api.concurrency import bounded_map
 from nudge_bot.api.nudge import NudgeClient
 from nudge_bot.api.utility import ResolutionStatus
 from nudge_bot.main import cli
 
+ASYNC_CHUNK_SIZE = 500
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+
+def _flatten(value, prefix=''):
+    # nested objects become dotted columns, lists are kept as a JSON string so every row has scalar values
+    flat = {}
+    for key, item in value.items():
+        column = f"{prefix}{key}"
+        if isinstance(item, dict):
+            flat.update(_flatten(item, f"{column}."))
+        elif isinstance(item, list):
+            flat[column] = json.dumps(item)
+        else:
+            flat[column] = item
+    return flat
+
+
+def _read_domains(nudge_client: NudgeClient, domain_list, all_apps):
+    if domain_list:
+        for line in domain_list:
+            domain = line.strip()
+            if domain:
+                yield domain
+        return
+    if all_apps:
+        apps = nudge_client.inventory.apps if nudge_client.inventory else \
+            nudge_client.iter_apps({"search": [], "filters": []}, per_page=100)
+        for app in apps:
+            domain = utility.get_canonical_domain(app) or app.get('domain_canonical')
+            if domain:
+                yield domain
+
+
+def _unique(domains):
+    seen = set()
+    for domain in domains:
+        key = domain.casefold()
+        if key not in seen:
+            seen.add(key)
+            yield domain
+
+
+def _fetch_service_info(nudge_client: NudgeClient, domain, max_age):
+    try:
+        return domain, nudge_client.get_service_info(domain, max_age=max_age), None
+    except Exception as e:
+        return domain, None, str(e)
+
+
+async def _fetch_service_info_async(client, domain):
+    try:
+        return domain, await client.get_service_info(domain), None
+    except Exception as e:
+        return domain, None, str(e)
+
+
+def _fetch_chunk_async(nudge_client: NudgeClient, domains, workers):
+    async def fetch_all(client):
+        return await asyncio.gather(*(_fetch_service_info_async(client, domain) for domain in domains))
+
+    return run_with_client(nudge_client, fetch_all, concurrency=workers)
+
+
+def _fetch_all_async(nudge_client: NudgeClient, domains, workers):
+    # the asyncio client has no response cache, domains are fetched a chunk at a time to keep streaming output
+    for chunk in utility.chunks(domains, ASYNC_CHUNK_SIZE):
+        yield from _fetch_chunk_async(nudge_client, chunk, workers)
+
+
+def _fetch_all(nudge_client: NudgeClient, domains, max_age, workers):
+    # a bounded window of in-flight lookups streams results as the domains are read instead of queueing them all
+    return bounded_map(lambda domain: _fetch_service_info(nudge_client, domain, max_age), domains, workers,
+                       window=workers * 2)
+
 
 @cli.command(name='app-info', short_help="App meta data search utility")
 @click.option('--domain', help='The domain to find the app metadata for (domain or name)')
+@click.option('--domain-list', help='A line delimited list of domains to export the metadata for', type=click.File('r'))
+@click.option('--all-apps', help='Export the metadata of every app', is_flag=True)
+@click.option('--output-file', help='The file to write the exported metadata', type=click.File('w'),
+              default="app_info.ndjson")
+@click.option('--output-format', help='NDJSON keeps the response as is, Flat writes one dotted column per value',
+              type=click.Choice(['NDJSON', 'Flat']), default='NDJSON')
+@click.option('--workers', help='Number of domains fetched in parallel', type=click.IntRange(min=1), default=8)
+@click.option('--max-age', type=click.IntRange(min=0),
+              help='Seconds a service detail in the --cache response cache is reused before fetching it again '
+                   '(defaults to 30 days)')
 @click.pass_obj
-def supply_chain(nudge_client: NudgeClient, domain):
-    service_info = nudge_client.get_service_info(domain)
-    click.secho(f"{domain}")
-    click.secho(json.dumps(service_info, indent=2))
+def supply_chain(nudge_client: NudgeClient, domain, domain_list, all_apps, output_file, output_format, workers,
+                 max_age):
+    if domain:
+        service_info = nudge_client.get_service_info(domain)
+        click.secho(f"{domain}")
+        click.secho(json.dumps(service_info, indent=2))
+        return
+    if not domain_list and not all_apps:
+        raise ClickException("Must provide one of --domain, --domain-list or --all-apps")
+    if max_age is not None and (nudge_client.cache is None or nudge_client.use_async):
+        # without the response cache every domain is fetched, a --max-age would silently do nothing
+        raise ClickException("--max-age requires --cache and is not used with --async-io")
+    exported = 0
+    failures = []
+    domains = _unique(_read_domains(nudge_client, domain_list, all_apps))
+    if nudge_client.use_async:
+        results = _fetch_all_async(nudge_client, domains, workers)
+    else:
+        results = _fetch_all(nudge_client, domains, max_age if max_age is not None else DEFAULT_MAX_AGE, workers)
+    with progressbar(results, label="Exporting") as bar:
+        for service_domain, service_info, error in bar:
+            if error is not None:
+                failures.append((service_domain, error))
+                continue
+            row = dict(service_info, domain=service_domain)
+            output_file.write(json.dumps(_flatten(row) if output_format == 'Flat' else row) + "\n")
+            exported += 1
+    click.secho(f"Exported {exported} domains", fg='green')
+    if len(failures) > 0:
+        click.secho(f"Failed to export {len(failures)} domains", fg='red')
+        for service_domain, error in failures:
+            click.secho(f"\t{service_domain}: {error}")
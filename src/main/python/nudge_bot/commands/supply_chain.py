@@ -3,6 +3,7 @@ import click
 from click import ClickException
 
 from nudge_bot.api import nudge, utility
+from nudge_bot.api.graph import crawl_supply_chain
 from nudge_bot.api.nudge import NudgeClient
 from nudge_bot.api.utility import ResolutionStatus
 from nudge_bot.main import cli
@@ -18,3 +19,47 @@ def supply_chain(nudge_client: NudgeClient, app_name):
         click.secho(f"{app_resolution.print_app_name()}")
         for supplier in suppliers:
             click.secho(f"\t{supplier['app_name']} - {supplier['domain_canonical']}")
+
+
+def _graph_roots(nudge_client: NudgeClient, app_names):
+    if app_names:
+        for app_name in app_names:
+            app_resolution = utility.resolve_app(app_name=app_name, nudge_client=nudge_client, interactive=True)
+            if app_resolution.status == ResolutionStatus.RESOLVED:
+                yield utility.get_canonical_domain(app_resolution.app), app_resolution.print_app_name()
+        return
+    if nudge_client.inventory:
+        apps = nudge_client.inventory.apps
+    else:
+        apps = nudge_client.iter_apps({"search": [], "filters": []}, per_page=100)
+    for app in apps:
+        yield utility.get_canonical_domain(app) or app.get('domain_canonical'), utility.get_app_name(app)
+
+
+@cli.command(name='supply-chain-graph', short_help="Crawl the transitive supply chain of your apps")
+@click.option('--app-name', help='The app to start from (can be specified multiple times, defaults to every app)',
+              multiple=True)
+@click.option('--max-depth', help='How many vendor levels to follow', type=click.IntRange(min=1), default=2)
+@click.option('--workers', help='Number of vendor lookups to run in parallel', type=click.IntRange(min=1), default=8)
+@click.option('--output-format', help='The output format', type=click.Choice(['Edges', 'GraphML', 'JSON']),
+              default='Edges')
+@click.option('--output-file', help='The file to write the graph', type=click.File('w'), default="supply_chain.txt")
+@click.pass_obj
+def supply_chain_graph(nudge_client: NudgeClient, app_name, max_depth, workers, output_format, output_file):
+    roots = list(_graph_roots(nudge_client, app_name))
+    if len(roots) == 0:
+        raise ClickException("No apps found to crawl")
+    graph = crawl_supply_chain(nudge_client, roots, max_depth=max_depth, workers=workers,
+                               on_level=lambda depth, count: click.secho(f"Level {depth}: {count} domains"))
+    if output_format == 'GraphML':
+        graph.write_graphml(output_file)
+    elif output_format == 'JSON':
+        graph.write_json(output_file)
+    else:
+        graph.write_edges(output_file)
+    click.secho(f"Found {len(graph.nodes)} domains and {len(graph.edges)} vendor relationships", fg='green')
+    if len(graph.failures) > 0:
+        click.secho(f"Failed to fetch the vendors of {len(graph.failures)} domains", fg='red')
+        for domain, error in graph.failures:
+            click.secho(f"\t{domain}: {error}")
+        raise ClickException(f"Failed to fetch the vendors of {len(graph.failures)} domains")
@@ -0,0 +1,27 @@
+import click
+from click import progressbar
+
+from nudge_bot.api.inventory import AppInventory, inventory_path
+from nudge_bot.api.nudge import NudgeClient
+from nudge_bot.api.records import App
+from nudge_bot.main import cli
+
+
+@cli.command(name='sync-inventory', short_help="Save a local snapshot of every app for offline resolution")
+@click.option('--page-workers', help='Number of pages fetched in parallel', type=click.IntRange(min=1), default=4)
+@click.pass_context
+def sync_inventory(ctx, page_workers):
+    nudge_client: NudgeClient = ctx.obj
+    search = {"search": [],
+              "filters": [],
+              "sorting": {"property": "account_count", "direction": "desc"}}
+    apps = []
+    # the snapshot is read straight from the API, a cached search would save stale apps as fresh
+    with progressbar(nudge_client.iter_app_pages(search, per_page=100, workers=page_workers, fresh=True),
+                     label="Fetching apps") as pages:
+        for values in pages:
+            # keep only the compact record of each app while the rest of the pages arrive
+            apps.extend(App.from_json(app) for app in values)
+    path = inventory_path(nudge_client.access_token, ctx.find_root().params['cache_dir'])
+    AppInventory(apps).save(path)
+    click.secho(f"Saved {len(apps)} apps to {path}", fg='green')
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from typing import List
 
 import click
@@ -8,33 +9,59 @@ from nudge_bot.api.nudge import NudgeClient
 from nudge_bot.api.utility import ResolutionStatus, AppResolution, AppResolutionCollection
 from nudge_bot.main import cli
 
+CHUNK_SIZE = 500
+MAX_REMEMBERED_SEARCHES = 10000
+
+
+def _read_entries(app_list):
+    for line in app_list:
+        if not line.strip():
+            continue
+        meta = line.split(',')
+        app_name = meta[0].strip()
+        value = None
+        if len(meta) > 1:
+            if len(meta) >2:
+                raise ClickException(f"Extraneous comma in line {line}")
+            value = meta[1].strip()
+        yield app_name, value
+
+
+def _find_chunk(chunk, found: OrderedDict, nudge_client: NudgeClient, workers):
+    # search once per distinct name, repeated names and domains share the result
+    missing = [app_name for app_name, value in chunk if nudge.search_key(app_name) not in found]
+    if missing:
+        found.update(utility.find_apps(missing, nudge_client, workers=workers))
+    for app_name, value in chunk:
+        found.move_to_end(nudge.search_key(app_name))
+    while len(found) > MAX_REMEMBERED_SEARCHES:
+        found.popitem(last=False)
+
 
 @cli.command(name='transform-app-list',short_help="Transform list of app names or domains to internal identifier")
 @click.option('--app-list',     help='A line delimited list of apps to set the field', type=click.File('r'), required=True)
 @click.option('--interactive',     help='Choose to resolve interactively', is_flag=True,default=False)
 @click.option('--transformed-list',     help='The file to write the transformed list', type=click.File('w'), default="transformed_list.txt")
+@click.option('--workers',     help='Number of app searches to run in parallel', type=click.IntRange(min=1), default=8)
 @click.pass_obj
-def transform_app_list(nudge_client:NudgeClient, app_list, transformed_list, interactive):
-    # do this to verify we can find the right field and value
-    results = AppResolutionCollection()
-    with progressbar(app_list.readlines()) as readlines:
-        for line in readlines:
-            meta = line.split(',')
-            app_name = meta[0].strip()
-            value = None
-            if len(meta) > 1:
-                if len(meta) >2:
-                    raise ClickException(f"Extraneous comma in line {line}")
-                value = meta[1].strip()
-            app_resolution = utility.resolve_app(app_name, nudge_client=nudge_client,interactive=interactive)
-            if value:
-                app_resolution.add_meta_data(value)
-            results.add(app_resolution)
-
-    click.secho(f"Transformed {results.count(ResolutionStatus.RESOLVED)} apps, writing to disk", fg='green')
-    for app_resolution in results.get(ResolutionStatus.RESOLVED):
-        transformed_list.writelines(f"{app_resolution.print()}\n")
-        click.secho(f"\t{app_resolution.print_app_name()}",fg='green')
+def transform_app_list(nudge_client:NudgeClient, app_list, transformed_list, interactive, workers):
+    # resolved rows are written as they are found, only the failures are kept for the summary
+    results = AppResolutionCollection(keep=[ResolutionStatus.NOT_FOUND, ResolutionStatus.AMBIGUOUS])
+    found = OrderedDict()
+    with progressbar(_read_entries(app_list), label="Resolving") as entries:
+        for chunk in utility.chunks(entries, CHUNK_SIZE):
+            _find_chunk(chunk, found, nudge_client, workers)
+            for app_name, value in chunk:
+                app_resolution = utility.resolve_app(app_name, nudge_client=nudge_client, interactive=interactive,
+                                                     apps=found[nudge.search_key(app_name)])
+                if value:
+                    app_resolution.add_meta_data(value)
+                results.add(app_resolution)
+                if app_resolution.status == ResolutionStatus.RESOLVED:
+                    transformed_list.writelines(f"{app_resolution.print()}\n")
+            transformed_list.flush()
+
+    click.secho(f"Transformed {results.count(ResolutionStatus.RESOLVED)} apps", fg='green')
     if results.count(ResolutionStatus.NOT_FOUND)>0:
         click.secho(f"Failed to find {results.count(ResolutionStatus.NOT_FOUND)} apps", fg='red')
         for app_resolution in results.get(ResolutionStatus.NOT_FOUND):
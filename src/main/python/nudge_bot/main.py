@@ -1,16 +1,158 @@
+import functools
+import importlib
+import os
+
 import click
 
-from nudge_bot.api.nudge import NudgeClient
+# command name -> (module registering it, short help shown by --help without importing the module)
+COMMANDS = {
+    'app-info': ('service_info', "App meta data search utility"),
+    'bulk-set-app-field': ('bulk_set_app_fields', "Set a field for list of apps"),
+    'create-field': ('create_field', "Create a field"),
+    'list-fields': ('list', "List all of the fields for your organization"),
+    'search-app': ('search_app', "Search for an app"),
+    'set-app-field': ('set_app_field', "Set a field for a given app"),
+    'supply-chain': ('supply_chain', "Supply chain search utility"),
+    'supply-chain-graph': ('supply_chain', "Crawl the transitive supply chain of your apps"),
+    'sync-inventory': ('sync_inventory', "Save a local snapshot of every app for offline resolution"),
+    'transform-app-list': ('transform_app_list', "Transform list of app names or domains to internal identifier"),
+    'update-field': ('update_field', "Update a field"),
+}
+
+
+class LazyGroup(click.Group):
+    # imports a command module only when that command is run
+
+    def __init__(self, *args, lazy_commands=None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands if lazy_commands else {}
 
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
 
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            # the module registers itself on this group through @cli.command
+            importlib.import_module(f"nudge_bot.commands.{self.lazy_commands[cmd_name][0]}")
+        return super().get_command(ctx, cmd_name)
 
-@click.group()
+    def format_commands(self, ctx, formatter):
+        names = self.list_commands(ctx)
+        if not names:
+            return
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in self.commands:
+                if self.commands[name].hidden:
+                    continue
+                rows.append((name, self.commands[name].get_short_help_str(limit)))
+            else:
+                rows.append((name, self.lazy_commands[name][1]))
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
 @click.option('--api-token', envvar='API_TOKEN',  help='API token for authentication')
+@click.option('--api-url', envvar='NUDGE_API_URL', help='Base URL of the Nudge Security API')
+@click.option('--rate-limit', envvar='NUDGE_RATE_LIMIT', type=click.FloatRange(min=0, min_open=True),
+              help='Maximum requests per second sent to the API')
+@click.option('--max-retries', envvar='NUDGE_MAX_RETRIES', type=click.IntRange(min=0), default=5,
+              help='Retries for throttled or unavailable requests')
+@click.option('--pool-size', envvar='NUDGE_POOL_SIZE', type=click.IntRange(min=1), default=10,
+              help='Maximum number of pooled keep-alive connections to the API')
+@click.option('--compress-requests', envvar='NUDGE_COMPRESS_REQUESTS', is_flag=True,
+              help='Gzip request bodies sent to the API')
+@click.option('--cache/--no-cache', envvar='NUDGE_CACHE', default=False,
+              help='Reuse field lists and app searches from the on-disk response cache (off by default)')
+@click.option('--refresh-cache', is_flag=True, help='Ignore cached responses and store fresh ones')
+@click.option('--cache-dir', envvar='NUDGE_CACHE_DIR', type=click.Path(file_okay=False),
+              help='Directory of the response cache (defaults to ~/.cache/nudge-bot)')
+@click.option('--cache-ttl', envvar='NUDGE_CACHE_TTL', type=click.IntRange(min=0), default=600,
+              help='Seconds a cached field list or app search stays fresh')
+@click.option('--cache-size', envvar='NUDGE_CACHE_SIZE', type=click.IntRange(min=1), default=20000,
+              help='Maximum number of cached responses kept, least recently used are dropped first')
+@click.option('--use-inventory', envvar='NUDGE_USE_INVENTORY', is_flag=True,
+              help='Resolve apps against the local snapshot from sync-inventory before searching the API')
+@click.option('--inventory-max-age', envvar='NUDGE_INVENTORY_MAX_AGE', type=click.IntRange(min=0), default=24 * 3600,
+              help='Seconds after which --use-inventory warns that the snapshot should be synced again')
+@click.option('--async-io', envvar='NUDGE_ASYNC_IO', is_flag=True,
+              help='Run the lookups of transform-app-list, app-info and supply-chain-graph on the asyncio client '
+                   '(requires aiohttp, skips the response cache and --hedge)')
+@click.option('--connect-timeout', envvar='NUDGE_CONNECT_TIMEOUT', type=click.FloatRange(min=0, min_open=True),
+              default=10, help='Seconds to wait for a connection to the API')
+@click.option('--read-timeout', envvar='NUDGE_READ_TIMEOUT', type=click.FloatRange(min=0, min_open=True),
+              default=60, help='Seconds to wait for a response before the request is retried')
+@click.option('--deadline', envvar='NUDGE_DEADLINE', type=click.FloatRange(min=0, min_open=True),
+              help='Seconds the whole command may spend, requests after it fail')
+@click.option('--hedge', envvar='NUDGE_HEDGE', is_flag=True,
+              help='Send a second copy of an app search or service lookup slower than the recent p95 latency')
+@click.option('--project-searches', envvar='NUDGE_PROJECT_SEARCHES', is_flag=True,
+              help='Ask app searches that only list or resolve apps for the summary properties only')
+@click.option('--stats', envvar='NUDGE_STATS', is_flag=True,
+              help='Print request counts and latency percentiles per endpoint when the command finishes')
+@click.option('--stats-format', envvar='NUDGE_STATS_FORMAT', type=click.Choice(['Text', 'JSON', 'OpenMetrics']),
+              default='Text', help='Format of the --stats summary')
+@click.option('--stats-file', envvar='NUDGE_STATS_FILE', type=click.Path(dir_okay=False, writable=True),
+              help='Write the --stats summary to this file instead of stderr')
 @click.pass_context
-def cli(ctx, api_token):
-    ctx.obj = NudgeClient(api_token)
+def cli(ctx, api_token, api_url, rate_limit, max_retries, pool_size, compress_requests, cache, refresh_cache,
+        cache_dir, cache_ttl, cache_size, use_inventory, inventory_max_age, async_io, connect_timeout, read_timeout,
+        deadline, hedge, project_searches, stats, stats_format, stats_file):
+    # the API stack is only imported once a command actually runs
+    from nudge_bot.api.nudge import NudgeClient
+
+    response_cache = _open_cache(api_token, cache_dir, cache_size, refresh_cache) if cache else None
+    inventory_loader = functools.partial(_load_inventory, api_token, cache_dir, inventory_max_age) \
+        if use_inventory else None
+    ctx.obj = NudgeClient(api_token, rate_limit=rate_limit, max_retries=max_retries, pool_size=pool_size,
+                          compress_requests=compress_requests, cache=response_cache, cache_ttl=cache_ttl,
+                          inventory_loader=inventory_loader, use_async=async_io, base_url=api_url,
+                          connect_timeout=connect_timeout, read_timeout=read_timeout, deadline=deadline, hedge=hedge,
+                          project_apps=project_searches)
+    if stats or stats_file:
+        _report_stats(ctx, stats_format, stats_file)
+
+
+def _open_cache(api_token, cache_dir, cache_size, refresh_cache):
+    import sqlite3
+    from nudge_bot.api.cache import ResponseCache
+
+    try:
+        return ResponseCache(api_token, path=cache_dir, max_entries=cache_size, refresh=refresh_cache)
+    except (OSError, sqlite3.Error) as e:
+        # a read-only home directory should not stop the command, it just runs without the cache
+        click.secho(f"Response cache unavailable, continuing without it: {e}", fg='yellow', err=True)
+        return None
+
+
+def _load_inventory(api_token, cache_dir, inventory_max_age):
+    from nudge_bot.api.inventory import AppInventory, inventory_path
+
+    path = inventory_path(api_token, cache_dir)
+    if not os.path.exists(path):
+        raise click.ClickException("No inventory snapshot found, run 'sync-inventory' first")
+    inventory = AppInventory.load(path)
+    if inventory.age() > inventory_max_age:
+        click.secho(f"The inventory snapshot is {inventory.age() / 3600:.1f} hours old, "
+                    f"run 'sync-inventory' to refresh it", fg='yellow', err=True)
+    return inventory
+
+
+def _report_stats(ctx, stats_format, stats_file):
+    from nudge_bot.api.stats import RequestStats
+
+    nudge_client = ctx.obj
+    request_stats = RequestStats()
+    nudge_client.add_request_hook(request_stats)
 
+    def report():
+        summary = request_stats.format(stats_format, nudge_client.counters)
+        if stats_file:
+            with open(stats_file, 'w') as out:
+                out.write(summary if summary.endswith("\n") else summary + "\n")
+        else:
+            click.echo(summary, err=True)
 
-# noinspection PyUnresolvedReferences
-from nudge_bot.commands import list, set_app_field, search_app, bulk_set_app_fields,\
-    create_field, transform_app_list, update_field, supply_chain, service_info
\ No newline at end of file
+    ctx.call_on_close(report)
@@ -0,0 +1,578 @@
+import asyncio
+import importlib.util
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from unittest import mock
+
+from mock_nudge_server import MockNudgeServer, MockTenant
+from nudge_bot.api.async_nudge import run_with_client
+from nudge_bot.api.bulk import BulkFieldWriter
+from nudge_bot.api.cache import CacheEntry, ResponseCache, cache_key
+from nudge_bot.api.concurrency import bounded_map
+from nudge_bot.api.fields import FieldRegistry
+from nudge_bot.api.hedge import Hedger
+from nudge_bot.api.inventory import AppInventory, _TextIndex
+from nudge_bot.api.journal import WriteJournal, default_journal_path
+from nudge_bot.api import nudge
+from nudge_bot.api.nudge import NudgeClient
+from nudge_bot.api.rate_limit import DeadlineExceeded, RateLimiter, RequestCounters, parse_retry_after
+from nudge_bot.api.records import App, AppSummary
+from nudge_bot.api.utility import AppRowFormatter
+
+
+class _Response:
+
+    def __init__(self, status_code=200) -> None:
+        super().__init__()
+        self.status_code = status_code
+
+
+class _TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+
+    def test_parse_retry_after_seconds(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertEqual(parse_retry_after("-1"), 0.0)
+
+    def test_parse_retry_after_http_date(self):
+        delay = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+        self.assertTrue(25 <= delay <= 30, delay)
+        self.assertEqual(parse_retry_after(formatdate(time.time() - 30, usegmt=True)), 0.0)
+
+    def test_parse_retry_after_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+
+    def test_throttle_halves_once_per_window(self):
+        limiter = RateLimiter(rate=16, window=1.0)
+        for _ in range(5):
+            limiter.on_throttle()
+        self.assertEqual(limiter.rate, 8)
+        limiter.decreased_at -= 1.0
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 4)
+
+    def test_throttle_keeps_min_rate(self):
+        limiter = RateLimiter(rate=1, min_rate=0.5, window=0)
+        for _ in range(5):
+            limiter.on_throttle()
+        self.assertEqual(limiter.rate, 0.5)
+
+    def test_success_increases_up_to_rate(self):
+        limiter = RateLimiter(rate=4, increase=1)
+        limiter.on_throttle()
+        limiter.on_success()
+        self.assertEqual(limiter.rate, 3)
+        for _ in range(5):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 4)
+
+    def test_reserve_waits_for_tokens(self):
+        limiter = RateLimiter(rate=10, burst=1)
+        self.assertEqual(limiter.reserve(), 0)
+        wait = limiter.reserve()
+        self.assertTrue(0 < wait <= 0.1, wait)
+
+    def test_retry_after_pauses_unlimited_bucket(self):
+        limiter = RateLimiter()
+        limiter.on_throttle(retry_after=5)
+        self.assertIsNone(limiter.rate)
+        self.assertGreater(limiter.paused_until - time.monotonic(), 4)
+
+    def test_counters(self):
+        counters = RequestCounters()
+        counters.increment('retried')
+        counters.increment('throttled', 2)
+        self.assertEqual((counters.requests, counters.retried, counters.throttled), (0, 1, 2))
+
+
+class BoundedMapTestCase(unittest.TestCase):
+
+    def test_results_in_input_order(self):
+        self.assertEqual(list(bounded_map(lambda item: time.sleep(0.01 * (item % 3)) or item * 2, range(20), 4)),
+                         [item * 2 for item in range(20)])
+
+    def test_input_is_read_ahead_by_window(self):
+        read = []
+
+        def items():
+            for item in range(100):
+                read.append(item)
+                yield item
+
+        results = bounded_map(lambda item: item, items(), 2, window=4)
+        self.assertEqual(next(results), 0)
+        self.assertEqual(len(read), 4)
+        self.assertEqual(list(results), list(range(1, 100)))
+
+
+class ResponseCacheTestCase(_TempDirTestCase):
+
+    def test_entry_ttl(self):
+        self.assertTrue(CacheEntry({}, None, time.time() - 5).is_fresh(10))
+        self.assertFalse(CacheEntry({}, None, time.time() - 5).is_fresh(1))
+
+    def test_put_get(self):
+        cache = ResponseCache('token', path=self.directory)
+        cache.put('apps', 'key', {"values": [1, 2]}, etag='"v1"')
+        entry = cache.get('key')
+        self.assertEqual(entry.value, {"values": [1, 2]})
+        self.assertEqual(entry.etag, '"v1"')
+        self.assertIsNone(cache.get('other'))
+
+    def test_least_recently_used_evicted(self):
+        cache = ResponseCache('token', path=self.directory, max_entries=2)
+        cache.put('apps', 'first', 1)
+        time.sleep(0.01)
+        cache.put('apps', 'second', 2)
+        time.sleep(0.01)
+        cache.get('first')
+        time.sleep(0.01)
+        cache.put('apps', 'third', 3)
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual(cache.get('first').value, 1)
+        self.assertEqual(cache.get('third').value, 3)
+
+    def test_tokens_do_not_share_entries(self):
+        ResponseCache('token', path=self.directory).put('apps', 'key', 1)
+        self.assertIsNone(ResponseCache('other token', path=self.directory).get('key'))
+
+    def test_invalidate_kind(self):
+        cache = ResponseCache('token', path=self.directory)
+        cache.put('apps', 'apps key', 1)
+        cache.put('fields', 'fields key', 2)
+        cache.invalidate('apps')
+        self.assertIsNone(cache.get('apps key'))
+        self.assertEqual(cache.get('fields key').value, 2)
+
+    def test_refresh_ignores_entries(self):
+        ResponseCache('token', path=self.directory).put('apps', 'key', 1)
+        self.assertIsNone(ResponseCache('token', path=self.directory, refresh=True).get('key'))
+
+    def test_etag_revalidation(self):
+        tenant = MockTenant(app_count=10)
+        with MockNudgeServer(tenant) as server:
+            cache = ResponseCache('token', path=self.directory)
+            client = NudgeClient('token', base_url=server.url, cache=cache)
+            api = f"/api/service/details/{tenant.apps[0]['domain_canonical']}"
+            first = client.cached_get('service', api, ttl=0)
+            stored_at = cache.get(cache_key(client.base_url, api)).stored_at
+            time.sleep(0.01)
+            server.reset_stats()
+            # a stale entry is revalidated with If-None-Match and the 304 keeps the cached body
+            self.assertEqual(client.cached_get('service', api, ttl=0), first)
+            self.assertEqual(server.requests, 1)
+            self.assertGreater(cache.get(cache_key(client.base_url, api)).stored_at, stored_at)
+            server.reset_stats()
+            self.assertEqual(client.cached_get('service', api, ttl=60), first)
+            self.assertEqual(server.requests, 0)
+
+
+class FieldRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = FieldRegistry([{"id": 9000, "name": "Approval Status",
+                                        "allowed_values": [{"id": 90000, "value": "Approved"}]},
+                                       {"id": 9001, "name": "Risk"}])
+
+    def test_lookups(self):
+        self.assertEqual(self.registry.by_name("approval STATUS")['id'], 9000)
+        self.assertEqual(self.registry.by_id("9001")['name'], "Risk")
+        self.assertIsNone(self.registry.by_name("Owner"))
+        self.assertTrue(self.registry.value_exists(9000, "APPROVED"))
+        self.assertEqual(self.registry.allowed_value_id("9000", "approved"), 90000)
+        self.assertFalse(self.registry.value_exists(9001, "Approved"))
+
+    def test_add_allowed_value(self):
+        self.registry.add_allowed_value(9001, {"id": 90010, "value": "High"})
+        self.assertEqual(self.registry.allowed_value_id(9001, "high"), 90010)
+        self.assertEqual(self.registry.by_id(9001)['allowed_values'], [{"id": 90010, "value": "High"}])
+        self.registry.add_allowed_value(1, {"id": 1, "value": "Unknown"})
+        self.assertFalse(self.registry.value_exists(1, "Unknown"))
+
+
+class NudgeClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tenant = MockTenant(app_count=10)
+        self.server = MockNudgeServer(self.tenant).start()
+        self.addCleanup(self.server.stop)
+        self.client = NudgeClient('token', base_url=self.server.url, max_retries=2)
+
+    def test_list_fields_pages_past_fifty(self):
+        for index in range(60):
+            self.tenant.fields.append({"id": 10000 + index, "name": f"Field {index}", "allowed_values": []})
+        self.server.reset_stats()
+        fields = self.client.list_fields()
+        self.assertEqual(len(fields), 63)
+        self.assertEqual(self.client.field_registry.by_name("field 59")['id'], 10059)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_throttled_request_is_retried(self):
+        server = MockNudgeServer(self.tenant, throttle_rate=0.5).start()
+        self.addCleanup(server.stop)
+        client = NudgeClient('token', base_url=server.url, max_retries=10)
+        for app in self.tenant.apps[:5]:
+            self.assertEqual(client.get_service_info(app['domain_canonical'])['name'], app['name'])
+        self.assertEqual(client.counters.throttled, server.throttled)
+        self.assertEqual(server.requests, 5 + server.throttled)
+
+    def test_pool_bounds_connections(self):
+        server = MockNudgeServer(self.tenant, latency=0.02).start()
+        self.addCleanup(server.stop)
+        client = NudgeClient('token', base_url=server.url, pool_size=2)
+        domains = [app['domain_canonical'] for app in self.tenant.apps] * 2
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            infos = list(executor.map(client.get_service_info, domains))
+        self.assertEqual(len(infos), 20)
+        self.assertEqual(server.requests, 20)
+        # eight threads share the two pooled keep-alive connections
+        self.assertLessEqual(len(server.connections), 2)
+
+    def test_compressed_request_body(self):
+        client = NudgeClient('token', base_url=self.server.url, compress_requests=True)
+        app = self.tenant.apps[0]
+        self.assertTrue(client.set_app_field(app['id'], 9000, "Approved"))
+        self.assertEqual(self.server.compressed, 1)
+        self.assertEqual([entry['allowed_value']['value'] for entry in app['fields'] if entry['field']['id'] == 9000],
+                         ["Approved"])
+
+    def test_create_is_not_retried_on_server_error(self):
+        server = _FailingCreateServer(self.tenant).start()
+        self.addCleanup(server.stop)
+        client = NudgeClient('token', base_url=server.url, max_retries=2)
+        with self.assertRaises(Exception):
+            client.create_field("Owner", "select", [], ["app"])
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(client.counters.retried, 0)
+
+    def test_search_does_not_send_projection_by_default(self):
+        server = _RecordingServer(self.tenant).start()
+        self.addCleanup(server.stop)
+        apps = NudgeClient('token', base_url=server.url).find_app(self.tenant.apps[0]['name'], minimal=True)
+        self.assertIsInstance(apps[0], AppSummary)
+        self.assertNotIn('properties', server.bodies[0])
+        NudgeClient('token', base_url=server.url, project_apps=True).find_app(self.tenant.apps[0]['name'],
+                                                                              minimal=True)
+        self.assertIn('properties', server.bodies[1])
+
+
+class _FailingCreateServer(MockNudgeServer):
+
+    def route(self, method, path, body, headers=None):
+        if method == 'POST' and path == '/fields':
+            return 503, {"error": "unavailable"}
+        return super().route(method, path, body, headers)
+
+
+class _RecordingServer(MockNudgeServer):
+
+    def __init__(self, tenant) -> None:
+        super().__init__(tenant)
+        self.bodies = []
+
+    def route(self, method, path, body, headers=None):
+        if path == '/apps/search':
+            self.bodies.append(body)
+        return super().route(method, path, body, headers)
+
+
+class _NoNetwork(socket.socket):
+
+    def connect(self, address):
+        raise AssertionError(f"Network access to {address}")
+
+
+class TldExtractorTestCase(_TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        nudge._tld_extractor = None
+        nudge._extract_domain.cache_clear()
+        self.addCleanup(nudge._extract_domain.cache_clear)
+        self.addCleanup(setattr, nudge, '_tld_extractor', None)
+
+    def test_extracts_without_network(self):
+        # an empty suffix list cache must fall back to the bundled snapshot, not download the list
+        with mock.patch.dict(os.environ, {'NUDGE_TLD_CACHE_DIR': self.directory}), \
+                mock.patch('socket.socket', _NoNetwork), \
+                mock.patch('socket.getaddrinfo', side_effect=AssertionError("DNS lookup")):
+            self.assertEqual(nudge._transform_app_name("https://www.example.co.uk/login"), "example")
+            self.assertEqual(nudge._transform_app_name("http://app.slack.com"), "slack")
+
+    def test_custom_suffix_file(self):
+        suffix_file = os.path.join(self.directory, 'suffixes.dat')
+        with open(suffix_file, 'w') as suffixes:
+            suffixes.write("com\ninternal.example\n")
+        with mock.patch.dict(os.environ, {'NUDGE_TLD_CACHE_DIR': self.directory, 'NUDGE_TLD_SUFFIX_FILE': suffix_file}):
+            self.assertEqual(nudge._transform_app_name("https://wiki.corp.internal.example"), "corp")
+
+
+class TextIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = _TextIndex()
+        for position, text in enumerate(["Zoom", "Zoom Rooms", "Slack", None]):
+            self.index.add(position, text)
+
+    def test_exact(self):
+        self.assertEqual(self.index.match_exact("ZOOM"), {0})
+        self.assertEqual(self.index.match_exact("zoo"), set())
+
+    def test_contains(self):
+        self.assertEqual(self.index.match_contains("room"), {1})
+        self.assertEqual(self.index.match_contains("o"), {0, 1})
+
+    def test_fuzzy(self):
+        scores = self.index.match_fuzzy("slak")
+        self.assertEqual(max(scores, key=scores.get), 2)
+
+
+class AppInventoryTestCase(_TempDirTestCase):
+
+    def test_save_load_and_find(self):
+        tenant = MockTenant(app_count=20)
+        path = os.path.join(self.directory, 'inventory.json.gz')
+        AppInventory(tenant.apps, synced_at=1000.0).save(path)
+        inventory = AppInventory.load(path)
+        app = tenant.apps_by_id['17']
+        self.assertEqual(inventory.synced_at, 1000.0)
+        self.assertGreater(inventory.age(), 0)
+        self.assertEqual([found.id for found in inventory.find(app['name'], exact=True)], [17])
+        self.assertEqual([found.id for found in inventory.find(f"https://{app['domain_canonical']}/")], [17])
+        self.assertEqual(inventory.find_similar(app['name'][1:])[0].id, 17)
+
+
+class WriteJournalTestCase(_TempDirTestCase):
+
+    def test_resume(self):
+        path = os.path.join(self.directory, 'bulk.journal')
+        with WriteJournal(path) as journal:
+            journal.record(" 12", 9000, "90000")
+        with WriteJournal(path, resume=True) as journal:
+            self.assertTrue(journal.is_applied("12", "9000", "90000"))
+            self.assertFalse(journal.is_applied("13", "9000", "90000"))
+            journal.record(13, 9000, "90000")
+        with open(path) as lines:
+            self.assertEqual(lines.read(), "12,9000,90000\n13,9000,90000\n")
+
+    def test_new_run_truncates(self):
+        path = os.path.join(self.directory, 'bulk.journal')
+        with WriteJournal(path) as journal:
+            journal.record(12, 9000, "90000")
+        with WriteJournal(path) as journal:
+            self.assertFalse(journal.is_applied(12, 9000, "90000"))
+        self.assertEqual(os.path.getsize(path), 0)
+
+    def test_without_path(self):
+        with WriteJournal(None, resume=True) as journal:
+            journal.record(12, 9000, "90000")
+            self.assertFalse(journal.is_applied(12, 9000, "90000"))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_default_path(self):
+        self.assertEqual(default_journal_path('apps.txt'), os.path.abspath('apps.txt') + '.journal')
+        self.assertIsNone(default_journal_path('<stdin>'))
+
+
+class BulkFieldWriterTestCase(unittest.TestCase):
+
+    def _writes(self, app_ids):
+        return [(app_id, app_id, 9000, 90000) for app_id in app_ids]
+
+    def _client(self, bulk_endpoint=True):
+        tenant = MockTenant(app_count=10)
+        server = MockNudgeServer(tenant, bulk_endpoint=bulk_endpoint).start()
+        self.addCleanup(server.stop)
+        return tenant, server, NudgeClient('token', base_url=server.url)
+
+    def test_bulk_write(self):
+        tenant, server, client = self._client()
+        app_ids = [str(app['id']) for app in tenant.apps[:5]]
+        writer = BulkFieldWriter(client, '/fields/{field_id}/apps', chunk_size=50)
+        self.assertEqual(list(writer.write(self._writes(app_ids))), [(app_id, None) for app_id in app_ids])
+        self.assertTrue(writer.supported)
+        self.assertEqual(server.requests, 1)
+
+    def test_missing_endpoint_falls_back_to_single_writes(self):
+        tenant, server, client = self._client(bulk_endpoint=False)
+        app_ids = [str(app['id']) for app in tenant.apps[:5]]
+        writer = BulkFieldWriter(client, '/fields/{field_id}/apps')
+        self.assertEqual(sorted(writer.write(self._writes(app_ids))), sorted((app_id, None) for app_id in app_ids))
+        self.assertFalse(writer.supported)
+        self.assertEqual(server.requests, 6)
+
+    def test_partial_update_is_resent_as_single_writes(self):
+        tenant, server, client = self._client()
+        app_ids = [str(app['id']) for app in tenant.apps[:3]] + ['999']
+        writer = BulkFieldWriter(client, '/fields/{field_id}/apps', chunk_size=50)
+        results = dict(writer.write(self._writes(app_ids)))
+        self.assertEqual([app_id for app_id, error in results.items() if error], ['999'])
+        self.assertEqual(writer.chunk_size, 25)
+        self.assertEqual(server.requests, 5)
+
+    def test_chunk_size_adapts(self):
+        writer = BulkFieldWriter(None, '/fields/{field_id}/apps', chunk_size=50, min_chunk=10, max_chunk=60,
+                                 target_latency=1.0)
+        writer._adapt(ok=True, latency=0.1)
+        writer._adapt(ok=True, latency=0.1)
+        self.assertEqual(writer.chunk_size, 60)
+        writer._adapt(ok=True, latency=5.0)
+        self.assertEqual(writer.chunk_size, 30)
+
+    def test_passed_deadline_stops_the_writes(self):
+        for bulk_endpoint in (True, False):
+            tenant, server, client = self._client(bulk_endpoint=bulk_endpoint)
+            client.deadline = time.monotonic() - 1
+            writer = BulkFieldWriter(client, '/fields/{field_id}/apps')
+            with self.assertRaises(DeadlineExceeded):
+                list(writer.write(self._writes([str(app['id']) for app in tenant.apps[:3]])))
+            self.assertEqual(server.requests, 0)
+
+
+class HedgerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.counters = RequestCounters()
+        self.hedger = Hedger(counters=self.counters, min_samples=3, min_delay=0.01)
+
+    def _learn(self, latency):
+        for _ in range(3):
+            self.hedger.send('key', lambda: _Response())
+        window = self.hedger._window('key')
+        for _ in range(3):
+            window.record(latency)
+
+    def test_no_hedge_without_samples(self):
+        self.assertIsNone(self.hedger.delay('key'))
+        self.assertEqual(self.hedger.send('key', lambda: _Response(201)).status_code, 201)
+        self.assertEqual(self.counters.hedged, 0)
+
+    def test_slow_read_is_hedged_on_daemon_threads(self):
+        self._learn(0.02)
+        daemons = []
+        release = threading.Event()
+
+        def call():
+            daemons.append(threading.current_thread().daemon)
+            release.wait(2)
+            return _Response(500)
+
+        def duplicate():
+            daemons.append(threading.current_thread().daemon)
+            return _Response(200)
+
+        response = self.hedger.send('key', call, duplicate)
+        release.set()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(daemons, [True, True])
+        self.assertEqual(self.counters.hedged, 1)
+        self.assertEqual(self.counters.hedges_won, 1)
+
+    def test_fast_read_is_not_hedged(self):
+        self._learn(0.5)
+        self.assertEqual(self.hedger.send('key', lambda: _Response()).status_code, 200)
+        self.assertEqual(self.counters.hedged, 0)
+
+    def test_duplicate_is_rate_limited_and_counted(self):
+        tenant = MockTenant(app_count=10)
+        server = MockNudgeServer(tenant, latency=0.2).start()
+        self.addCleanup(server.stop)
+        client = NudgeClient('token', base_url=server.url, hedge=True)
+        with mock.patch.object(client.hedger, 'delay', return_value=0.01), \
+                mock.patch.object(client.rate_limiter, 'acquire') as acquire:
+            client.get_service_info(tenant.apps[0]['domain_canonical'])
+        self.assertEqual(client.counters.hedged, 1)
+        self.assertEqual(client.counters.requests, 2)
+        self.assertEqual(acquire.call_count, 2)
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiohttp'), "the asyncio client requires aiohttp")
+class AsyncNudgeClientTestCase(unittest.TestCase):
+
+    def test_run_with_client_settings(self):
+        tenant = MockTenant(app_count=10)
+        with MockNudgeServer(tenant) as server:
+            client = NudgeClient('token', base_url=server.url, max_retries=1, pool_size=3)
+
+            async def work(async_client):
+                await asyncio.sleep(0)
+                return async_client.max_retries, async_client.pool_size, async_client.rate_limiter, \
+                    await async_client.get_service_info(tenant.apps[0]['domain_canonical'])
+
+            max_retries, pool_size, rate_limiter, info = run_with_client(client, work, concurrency=2)
+        self.assertEqual((max_retries, pool_size), (1, 3))
+        self.assertIs(rate_limiter, client.rate_limiter)
+        self.assertEqual(info['name'], tenant.apps[0]['name'])
+        self.assertEqual(client.counters.requests, 1)
+
+
+class RecordsTestCase(unittest.TestCase):
+
+    def _app(self, app_id=1):
+        return {"id": app_id, "name": "Zoom", "account_count": 3, "domain_canonical": "zoom.us",
+                "service_info": {"name": "Zoom", "service_canonical_domain": "zoom.us", "category": {"name": "Video"}},
+                "counters": {"total_accounts": 3},
+                "fields": [{"field": {"id": 9000, "name": "Approval Status"},
+                            "allowed_value": {"id": 90000, "value": "Approved"}}]}
+
+    def test_app_round_trip(self):
+        app = App.from_json(self._app())
+        self.assertEqual(App.from_json(app.to_json()).to_json(), app.to_json())
+        self.assertEqual(app.to_json(), self._app())
+        self.assertIs(App.from_json(app), app)
+        self.assertEqual([(field.name, allowed_value.value) for field, allowed_value in app.fields],
+                         [("Approval Status", "Approved")])
+
+    def test_field_values_are_interned(self):
+        first, second = App.from_json(self._app(1)), App.from_json(self._app(2))
+        self.assertIs(first.fields[0][0], second.fields[0][0])
+        self.assertIs(first.fields[0][1], second.fields[0][1])
+
+    def test_summary_item_access(self):
+        summary = AppSummary.from_json(self._app())
+        self.assertEqual(summary['id'], 1)
+        self.assertEqual(summary.get('domain_canonical'), "zoom.us")
+        self.assertEqual(summary.canonical_domain, "zoom.us")
+        self.assertIsNone(summary.get('fields'))
+        with self.assertRaises(KeyError):
+            summary['fields']
+        self.assertFalse(hasattr(summary, '__dict__'))
+
+
+class AppRowFormatterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = {"id": 7, "name": "acme",
+                    "service_info": {"name": 'Acme, "Cloud"', "category": {"name": "Security"}},
+                    "counters": {"total_accounts": 12},
+                    "fields": [{"field": {"id": 9000, "name": "Approval Status"},
+                                "allowed_value": {"id": 90000, "value": "Approved"}},
+                               {"field": {"id": 9001, "name": "SSO Provider"},
+                                "allowed_value": {"id": 90010, "value": "Okta"}},
+                               {"field": {"id": 9001, "name": "SSO Provider"},
+                                "allowed_value": {"id": 90011, "value": "Google"}}]}
+        self.formatter = AppRowFormatter(["Approval Status", "Risk", "SSO Provider"])
+
+    def test_header(self):
+        # the leading spaces keep the header of the hand written CSV the output used to have
+        self.assertEqual(self.formatter.header(),
+                         ["App", " Category", " Accounts", "Approval Status", "Risk", "SSO Provider"])
+
+    def test_row_of_dict_and_record(self):
+        expected = ['Acme "Cloud"', "Security", "12", "Approved", "Not Set", "Okta:Google"]
+        self.assertEqual(self.formatter.row(self.app), expected)
+        self.assertEqual(self.formatter.row(App.from_json(self.app)), expected)
@@ -0,0 +1,67 @@
+import os
+import random
+import statistics
+import time
+import unittest
+
+from click.testing import CliRunner
+
+from mock_nudge_server import MockNudgeServer, MockTenant
+from nudge_bot.main import cli
+
+# the end-to-end benchmarks start a local server and run for minutes, so they only run on request
+BENCHMARK = os.environ.get('NUDGE_BENCHMARK') == '1'
+SIZES = [int(size) for size in os.environ.get('NUDGE_BENCHMARK_SIZES', '1000,10000,100000').split(',')]
+LATENCY = float(os.environ.get('NUDGE_BENCHMARK_LATENCY', '0.02'))
+THROTTLE_RATE = float(os.environ.get('NUDGE_BENCHMARK_THROTTLE_RATE', '0.01'))
+SAMPLE_SIZE = 1000
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+@unittest.skipUnless(BENCHMARK, "Set NUDGE_BENCHMARK=1 to run the end-to-end benchmarks")
+class BenchmarkTestCase(unittest.TestCase):
+
+    def _run(self, server, name, items, args):
+        server.reset_stats()
+        runner = CliRunner()
+        start = time.perf_counter()
+        result = runner.invoke(cli, ['--api-token', 'benchmark', '--api-url', server.url, '--no-cache'] + args)
+        elapsed = time.perf_counter() - start
+        self.assertEqual(result.exit_code, 0, f"{name} failed: {result.output} {result.exception}")
+        times = server.request_times
+        print(f"{name}: {items} items in {elapsed:.2f}s ({items / elapsed:.1f}/s), {server.requests} requests "
+              f"({server.throttled} throttled), server p50 {_percentile(times, 50) * 1000:.1f}ms "
+              f"p99 {_percentile(times, 99) * 1000:.1f}ms, mean {statistics.fmean(times or [0]) * 1000:.1f}ms")
+        return result
+
+    def test_benchmarks(self):
+        for size in SIZES:
+            with self.subTest(size=size):
+                tenant = MockTenant(app_count=size)
+                with MockNudgeServer(tenant, latency=LATENCY, jitter=LATENCY, throttle_rate=THROTTLE_RATE) as server:
+                    self._benchmark(server, tenant, size)
+
+    def _benchmark(self, server, tenant, size):
+        runner = CliRunner()
+        sample = random.Random(size).sample(tenant.apps, min(size, SAMPLE_SIZE))
+        with runner.isolated_filesystem():
+            self._run(server, f"search-app [{size}]", size,
+                      ['search-app', '--all-apps', '--output-to-file', '--output-file', 'apps.csv',
+                       '--page-workers', '4'])
+
+            with open('app_names.txt', 'w') as names:
+                names.write("\n".join(app['service_info']['name'] for app in sample) + "\n")
+            self._run(server, f"transform-app-list [{size}]", len(sample),
+                      ['transform-app-list', '--app-list', 'app_names.txt', '--transformed-list', 'app_ids.txt'])
+
+            with open('app_ids.txt', 'w') as ids:
+                ids.write("\n".join(f"{app['id']},{app['name']}" for app in sample) + "\n")
+            self._run(server, f"bulk-set-app-field [{size}]", len(sample),
+                      ['bulk-set-app-field', '--field', 'Approval Status', '--value', 'Approved',
+                       '--app-list', 'app_ids.txt', '--concurrency', '8'])
@@ -31,6 +31,7 @@ class CommandlineTestCase(unittest.TestCase):
         runner = CliRunner()
         result = runner.invoke(cli, ['search-app', '--app-name', "zoom"])
         self.assertEqual(result.exit_code, 0, f"Did not get good exit code: {result.stdout} {result.exception}")
+
     def test_search_app_field(self):
         runner = CliRunner()
         result = runner.invoke(cli, ['search-app',"--field-name", "Approval Status", "--field-value", "Approved",
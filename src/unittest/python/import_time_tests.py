@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# run in a fresh interpreter so modules already imported by the test runner do not hide a regression
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from click.testing import CliRunner
+from nudge_bot.main import cli
+result = CliRunner().invoke(cli, ['--help'])
+elapsed = time.perf_counter() - start
+heavy = [module for module in ('requests', 'tldextract', 'pydash', 'aiohttp') if module in sys.modules]
+print(json.dumps({"exit_code": result.exit_code, "elapsed": elapsed, "heavy": heavy}))
+"""
+
+MAX_HELP_SECONDS = 0.5
+
+
+class ImportTimeTestCase(unittest.TestCase):
+
+    def _run_startup(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT], env=env)
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+    def test_help_does_not_import_api_stack(self):
+        startup = self._run_startup()
+        self.assertEqual(startup['exit_code'], 0)
+        self.assertEqual(startup['heavy'], [], f"--help imported {startup['heavy']}")
+
+    def test_help_startup_time(self):
+        # best of three to keep a busy build machine from failing the run
+        elapsed = min(self._run_startup()['elapsed'] for _ in range(3))
+        print(f"nudge-bot --help started in {elapsed * 1000:.1f}ms")
+        self.assertLess(elapsed, MAX_HELP_SECONDS, f"--help took {elapsed:.3f}s")
@@ -0,0 +1,507 @@
+import csv
+import importlib.util
+import json
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from mock_nudge_server import MockNudgeServer, MockTenant
+from nudge_bot.api.inventory import inventory_path
+from nudge_bot.main import cli
+
+APP_COUNT = 120
+
+
+class MockServerTestCase(unittest.TestCase):
+    app_count = APP_COUNT
+
+    def setUp(self):
+        self.tenant = MockTenant(app_count=self.app_count)
+        self.server = self._server(self.tenant).start()
+        self.addCleanup(self.server.stop)
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+
+    def _server(self, tenant):
+        return MockNudgeServer(tenant)
+
+    def _invoke(self, args, **kwargs):
+        self.server.reset_stats()
+        return CliRunner().invoke(cli, ['--api-token', 'test', '--api-url', self.server.url, '--cache-dir',
+                                        self.cache_dir] + args, **kwargs)
+
+    def assertSucceeded(self, result):
+        self.assertEqual(result.exit_code, 0, f"Did not get good exit code: {result.output} {result.exception}")
+
+    def _apps(self, count, start=0):
+        return self.tenant.apps[start:start + count]
+
+    def _write_app_list(self, path, apps):
+        with open(path, 'w') as app_list:
+            app_list.write("".join(f"{app['id']},{app['name']}\n" for app in apps))
+
+    def _field_value(self, app, field_name):
+        return [entry['allowed_value']['value'] for entry in app['fields'] if entry['field']['name'] == field_name]
+
+
+class SearchAppTestCase(MockServerTestCase):
+    # enough apps for searches to span several pages
+    app_count = 400
+
+    def test_search_app_prefetch(self):
+        expected = [app for app in self.tenant.apps if not self._field_value(app, "Approval Status")]
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['search-app', '--field-name', "Approval Status", "--field-value", "None",
+                                   "--output-to-file", "--prefetch"])
+            with open('search_list.csv') as output:
+                rows = list(csv.reader(output))
+        self.assertSucceeded(result)
+        self.assertGreater(len(expected), 100)
+        self.assertEqual(len(rows), len(expected) + 1)
+        self.assertEqual([row[0] for row in rows[1:]], [app['name'] for app in expected])
+        # the app pages plus the field list for the CSV header
+        self.assertEqual(self.server.requests, math.ceil(len(expected) / 100) + 1)
+
+    def test_search_app_parallel_pages(self):
+        expected = [str(app['id']) for app in self.tenant.apps if not self._field_value(app, "Approval Status")]
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['search-app', '--field-name', "Approval Status", "--field-value", "None",
+                                   "--output-to-file", "--output-format", "Id", "--per-page", "25",
+                                   "--page-workers", "4"])
+            with open('search_list.csv') as output:
+                ids = [line.strip() for line in output]
+        self.assertSucceeded(result)
+        # pages fetched in parallel still come back in account count order
+        self.assertEqual(ids, expected)
+        self.assertEqual(self.server.requests, math.ceil(len(expected) / 25))
+
+    def test_search_app_cache(self):
+        args = ['--cache', 'search-app', '--app-name', self.tenant.apps_by_id['117']['name']]
+        self.assertSucceeded(self._invoke(args))
+        self.assertEqual(self.server.requests, 1)
+        result = self._invoke(args)
+        self.assertSucceeded(result)
+        self.assertIn(self.tenant.apps_by_id['117']['name'], result.output)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_search_app_unwritable_cache(self):
+        # a cache directory under a regular file can never be created
+        not_a_directory = os.path.join(self.cache_dir, 'file')
+        open(not_a_directory, 'w').close()
+        result = CliRunner().invoke(cli, ['--api-token', 'test', '--api-url', self.server.url, '--cache',
+                                          '--cache-dir', os.path.join(not_a_directory, 'cache'), 'search-app',
+                                          '--app-name', self.tenant.apps_by_id['117']['name']])
+        self.assertSucceeded(result)
+        self.assertIn("Response cache unavailable", result.output)
+
+    def test_search_app_csv_quoting(self):
+        app = self.tenant.apps_by_id['117']
+        app['name'] = app['service_info']['name'] = 'Acme, "Cloud" 117'
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['search-app', '--app-name', "Acme", "--output-to-file"])
+            with open('search_list.csv') as output:
+                rows = list(csv.reader(output))
+        self.assertSucceeded(result)
+        self.assertEqual(rows[0], ["App", " Category", " Accounts", "Approval Status", "Risk", "SSO Provider"])
+        # commas are dropped from names, quotes survive the csv quoting
+        self.assertEqual(rows[1][:3], ['Acme "Cloud" 117', app['service_info']['category']['name'],
+                                       str(app['counters']['total_accounts'])])
+        self.assertEqual(len(rows), 2)
+
+    def test_search_app_ids(self):
+        category = self.tenant.apps[0]['service_info']['category']['name']
+        expected = [str(app['id']) for app in self.tenant.apps
+                    if app['service_info']['category']['name'] == category]
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['search-app', '--category', category, "--output-to-file", "--output-format", "Id"])
+            with open('search_list.csv') as output:
+                ids = [line.strip() for line in output if line.strip()]
+        self.assertSucceeded(result)
+        self.assertEqual(ids, expected)
+
+    def test_search_app_stats(self):
+        app = self.tenant.apps_by_id['117']
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['--stats', '--stats-format', 'OpenMetrics', '--stats-file', 'stats.txt',
+                                   'search-app', '--app-name', app['name']])
+            with open('stats.txt') as stats:
+                metrics = stats.read()
+        self.assertSucceeded(result)
+        self.assertIn(f"{app['name']}: {app['account_count']}", result.output)
+        self.assertIn('nudge_requests_total{endpoint="POST /apps/search",status="200"} 1', metrics)
+        self.assertTrue(metrics.endswith("# EOF\n"))
+
+    def test_search_app_hedged_with_deadline(self):
+        category = self.tenant.apps[0]['service_info']['category']['name']
+        expected = sum(1 for app in self.tenant.apps if app['service_info']['category']['name'] == category)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['--hedge', '--deadline', '60', '--read-timeout', '30', '--stats-file', 'stats.json',
+                                   '--stats-format', 'JSON', 'search-app', '--category', category, "--output-to-file",
+                                   "--output-format", "Id"])
+            with open('stats.json') as stats:
+                summary = json.load(stats)
+        self.assertSucceeded(result)
+        # too few samples to know the p95, so nothing is hedged
+        self.assertEqual(summary['hedged'], 0)
+        self.assertEqual(self.server.requests, math.ceil(expected / 50))
+
+
+class TransformAppListTestCase(MockServerTestCase):
+
+    def test_transform_app_list_searches_once_per_app(self):
+        first, second, third = (self.tenant.apps_by_id[app_id] for app_id in ('100', '101', '102'))
+        lines = [first['name'], first['name'].upper(), f" {first['name'].lower()} ",
+                 f"https://www.{second['domain_canonical']}", f"http://{second['domain_canonical']}/login",
+                 third['name'], third['name']]
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('apps.txt', 'w') as app_list:
+                app_list.write("".join(f"{line}\n" for line in lines))
+            result = self._invoke(['transform-app-list', '--app-list', 'apps.txt'])
+            with open('transformed_list.txt') as transformed:
+                ids = [line.split(',')[0] for line in transformed]
+        self.assertSucceeded(result)
+        self.assertIn("Transformed 7 apps", result.output)
+        self.assertEqual(ids, ['100'] * 3 + ['101'] * 2 + ['102'] * 2)
+        # repeated and case-variant names, and urls of the same domain, share one search
+        self.assertEqual(self.server.requests, 3)
+
+
+class InventoryTestCase(MockServerTestCase):
+
+    def test_sync_inventory(self):
+        apps = self._apps(5, start=100)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['sync-inventory'])
+            self.assertSucceeded(result)
+            self.assertIn(f"Saved {APP_COUNT} apps", result.output)
+            with open('names.txt', 'w') as names:
+                names.write("".join(f"{app['name']}\n" for app in apps))
+            result = self._invoke(['--use-inventory', 'transform-app-list', '--app-list', 'names.txt'])
+            with open('transformed_list.txt') as output:
+                ids = [line.split(',')[0] for line in output]
+        self.assertSucceeded(result)
+        self.assertEqual(ids, [str(app['id']) for app in apps])
+        # every name is resolved from the snapshot
+        self.assertEqual(self.server.requests, 0)
+        self.assertNotIn("inventory snapshot is", result.output)
+
+    def test_sync_inventory_bypasses_cache(self):
+        self.assertSucceeded(self._invoke(['--cache', 'sync-inventory']))
+        result = self._invoke(['--cache', 'sync-inventory'])
+        self.assertSucceeded(result)
+        self.assertEqual(self.server.requests, math.ceil(APP_COUNT / 100))
+
+    def test_sync_inventory_with_use_inventory_set(self):
+        # there is no snapshot yet, the command that creates it must not need one
+        result = self._invoke(['sync-inventory'], env={'NUDGE_USE_INVENTORY': '1'})
+        self.assertSucceeded(result)
+        self.assertIn(f"Saved {APP_COUNT} apps", result.output)
+
+    def test_inventory_is_loaded_on_first_lookup(self):
+        # a corrupt snapshot shows whether a command read it
+        with open(inventory_path('test', self.cache_dir), 'w') as snapshot:
+            snapshot.write("not a snapshot")
+        self.assertSucceeded(self._invoke(['--use-inventory', 'list-fields']))
+        result = self._invoke(['--use-inventory', 'search-app', '--app-name', self.tenant.apps_by_id['117']['name']])
+        self.assertNotEqual(result.exit_code, 0)
+
+    def test_old_inventory_warns(self):
+        self.assertSucceeded(self._invoke(['sync-inventory']))
+        result = self._invoke(['--use-inventory', '--inventory-max-age', '0', 'search-app', '--app-name',
+                               self.tenant.apps_by_id['117']['name']])
+        self.assertSucceeded(result)
+        self.assertIn("run 'sync-inventory' to refresh it", result.output)
+        self.assertEqual(self.server.requests, 0)
+
+
+class BulkSetAppFieldTestCase(MockServerTestCase):
+
+    def _bulk_args(self, *args):
+        return ['bulk-set-app-field', '--field', "APPROVAL STATUS", "--value", "Approved"] + list(args)
+
+    def assertApproved(self, apps):
+        for app in apps:
+            self.assertEqual(self._field_value(app, "Approval Status"), ["Approved"], app['name'])
+
+    def test_bulk_app_set_concurrent(self):
+        apps = self._apps(10)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', apps)
+            result = self._invoke(self._bulk_args('--concurrency', '4', '--app-list', 'apps.txt'))
+            files = os.listdir('.')
+        self.assertSucceeded(result)
+        self.assertIn("Finished updating 10", result.output)
+        self.assertApproved(apps)
+        # the field list and one write per app, no journal unless asked for
+        self.assertEqual(self.server.requests, 11)
+        self.assertEqual(files, ['apps.txt'])
+
+    def test_bulk_app_set_stdin(self):
+        apps = self._apps(3)
+        data = "".join(f"{app['id']},{app['name']}\n" for app in apps)
+        result = self._invoke(self._bulk_args('--app-list', '-'), input=data)
+        self.assertSucceeded(result)
+        self.assertIn("Finished updating 3", result.output)
+        self.assertApproved(apps)
+
+    def test_bulk_app_set_resume(self):
+        apps = self._apps(5)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', apps)
+            args = self._bulk_args('--journal', 'bulk.journal', '--app-list', 'apps.txt')
+            result = self._invoke(args)
+            self.assertSucceeded(result)
+            with open('bulk.journal') as journal:
+                self.assertEqual(len(journal.readlines()), 5)
+            result = self._invoke(args + ['--resume'])
+        self.assertSucceeded(result)
+        self.assertIn("Skipped 5 updates already applied", result.output)
+        # only the field list, every write is in the journal
+        self.assertEqual(self.server.requests, 1)
+
+    def test_bulk_app_set_skip_unchanged(self):
+        apps = self._apps(10)
+        for app in apps[:4]:
+            self.tenant.set_field(app['id'], 9000, "Approved")
+        already_approved = sum(1 for app in self.tenant.apps
+                               if self._field_value(app, "Approval Status") == ["Approved"])
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', apps)
+            result = self._invoke(self._bulk_args('--skip-unchanged', '--app-list', 'apps.txt'))
+        self.assertSucceeded(result)
+        self.assertIn("Unchanged 4, changed 6, failed 0", result.output)
+        self.assertApproved(apps)
+        # field list, the pages of apps already set to the value, then only the changed apps are written
+        self.assertEqual(self.server.requests, 1 + math.ceil(already_approved / 100) + 6)
+
+    def test_bulk_app_set_skip_unchanged_ignores_inventory(self):
+        apps = self._apps(4)
+        self.assertSucceeded(self._invoke(['sync-inventory']))
+        # approved after the snapshot was taken, the live search still sees it
+        self.tenant.set_field(apps[0]['id'], 9000, "Approved")
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', apps)
+            result = self._invoke(['--use-inventory'] + self._bulk_args('--skip-unchanged', '--app-list', 'apps.txt'))
+        self.assertSucceeded(result)
+        self.assertIn("Unchanged 1, changed 3, failed 0", result.output)
+
+    def test_bulk_app_set_batched(self):
+        apps = self._apps(20)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', apps)
+            result = self._invoke(self._bulk_args('--bulk', '--bulk-endpoint', '/fields/{field_id}/apps',
+                                                  '--concurrency', '4', '--app-list', 'apps.txt'))
+        self.assertSucceeded(result)
+        self.assertIn("Finished updating 20", result.output)
+        self.assertApproved(apps)
+        # the field list and one batch for the 20 apps
+        self.assertEqual(self.server.requests, 2)
+
+    def test_bulk_app_set_batched_requires_endpoint(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', self._apps(2))
+            result = self._invoke(self._bulk_args('--bulk', '--app-list', 'apps.txt'))
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("--bulk requires --bulk-endpoint", result.output)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_bulk_app_set_rejects_app_names(self):
+        apps = self._apps(3)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('apps.txt', 'w') as app_list:
+                app_list.write("".join(f"{app['id']},{app['name']}\n" for app in apps) + "zoom,Zoom\n")
+            result = self._invoke(self._bulk_args('--app-list', 'apps.txt'))
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Failed to update 1 of 4 apps", result.output)
+        self.assertIn("zoom,Zoom: Entry found with an app name", result.output)
+        self.assertApproved(apps)
+        self.assertEqual(self.server.requests, 4)
+
+
+class BulkSetAppFieldDeadlineTestCase(MockServerTestCase):
+
+    def _server(self, tenant):
+        return MockNudgeServer(tenant, latency=0.05)
+
+    def test_bulk_app_set_stops_at_deadline(self):
+        apps = self._apps(40)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', apps)
+            result = self._invoke(['--deadline', '0.3', 'bulk-set-app-field', '--field', "APPROVAL STATUS",
+                                   "--value", "Approved", '--app-list', 'apps.txt'])
+        self.assertEqual(result.exit_code, 1)
+        # one error for the run instead of a failure reported against every remaining row
+        self.assertIn("Deadline of 0.3s exceeded", result.output)
+        self.assertNotIn("Failed to update", result.output)
+        self.assertLess(self.server.requests, 1 + len(apps))
+
+
+class SupplyChainGraphTestCase(MockServerTestCase):
+
+    def test_supply_chain_graph(self):
+        app = self.tenant.apps_by_id['117']
+        vendors = {vendor['domain_canonical'] for vendor in self.tenant.vendors(app['domain_canonical'])}
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['supply-chain-graph', '--app-name', app['name'], '--max-depth', '2',
+                                   '--output-format', 'JSON', '--output-file', 'graph.json'])
+            with open('graph.json') as output:
+                graph = json.load(output)
+        self.assertSucceeded(result)
+        self.assertEqual({edge['target'] for edge in graph['edges'] if edge['source'] == app['domain_canonical']},
+                         vendors)
+        # the app search, then every domain above the last level is looked up once however many apps share it
+        crawled = [node for node in graph['nodes'] if node['depth'] < 2]
+        self.assertEqual(self.server.requests, 1 + len(crawled))
+
+
+class ServiceInfoTestCase(MockServerTestCase):
+
+    def _write_domains(self, path, domains):
+        with open(path, 'w') as domain_list:
+            domain_list.write("".join(f"{domain}\n" for domain in domains))
+
+    def test_service_info_bulk(self):
+        domains = [app['domain_canonical'] for app in self._apps(2)]
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_domains('domains.txt', [domains[0], domains[1], domains[0].upper()])
+            result = self._invoke(['app-info', '--domain-list', 'domains.txt', '--output-format', 'Flat'])
+            with open('app_info.ndjson') as output:
+                rows = [json.loads(line) for line in output]
+        self.assertSucceeded(result)
+        self.assertIn("Exported 2 domains", result.output)
+        self.assertEqual([row['domain'] for row in rows], domains)
+        self.assertEqual(rows[0]['hosting.country'], "US")
+        self.assertEqual(self.server.requests, 2)
+
+    def test_service_info_bulk_cached(self):
+        domains = [app['domain_canonical'] for app in self._apps(30)]
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_domains('domains.txt', domains)
+            args = ['--cache', 'app-info', '--domain-list', 'domains.txt', '--workers', '4']
+            self.assertSucceeded(self._invoke(args))
+            self.assertEqual(self.server.requests, 30)
+            result = self._invoke(args)
+            with open('app_info.ndjson') as output:
+                rows = [json.loads(line) for line in output]
+        self.assertSucceeded(result)
+        self.assertEqual([row['domain'] for row in rows], domains)
+        # the second run is answered from the response cache
+        self.assertEqual(self.server.requests, 0)
+
+    def test_service_info_max_age_requires_cache(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_domains('domains.txt', [self.tenant.apps[0]['domain_canonical']])
+            result = self._invoke(['app-info', '--domain-list', 'domains.txt', '--max-age', '60'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("--max-age requires --cache", result.output)
+        self.assertEqual(self.server.requests, 0)
+
+
+class FailingVendorServer(MockNudgeServer):
+
+    def __init__(self, tenant, failing_domain) -> None:
+        super().__init__(tenant)
+        self.failing_domain = failing_domain
+
+    def route(self, method, path, body, headers=None):
+        if path == f"/api/service/vendors/{self.failing_domain}":
+            return 404, {"error": "unknown domain"}
+        return super().route(method, path, body, headers)
+
+
+class SupplyChainGraphFailureTestCase(MockServerTestCase):
+
+    def _server(self, tenant):
+        return FailingVendorServer(tenant, tenant.apps[0]['domain_canonical'])
+
+    def test_supply_chain_graph_reports_failures(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = self._invoke(['supply-chain-graph', '--max-depth', '1', '--output-file', 'graph.txt'])
+            graph_written = os.path.exists('graph.txt')
+        self.assertEqual(result.exit_code, 1)
+        self.assertTrue(graph_written)
+        self.assertIn("Failed to fetch the vendors of 1 domains", result.output)
+        self.assertIn(self.tenant.apps[0]['domain_canonical'], result.output)
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiohttp'), "the asyncio client requires aiohttp")
+class AsyncIoTestCase(MockServerTestCase):
+
+    def test_transform_app_list_async(self):
+        apps = self._apps(5, start=100)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('names.txt', 'w') as names:
+                names.write("".join(f"{app['name']}\n" for app in apps))
+            result = self._invoke(['--async-io', '--stats-file', 'stats.json', '--stats-format', 'JSON',
+                                   'transform-app-list', '--app-list', 'names.txt'])
+            with open('stats.json') as stats:
+                summary = json.load(stats)
+        self.assertSucceeded(result)
+        self.assertIn("Transformed 5 apps", result.output)
+        # the asyncio requests are counted on the shared client
+        self.assertEqual(summary['requests'], 5)
+        self.assertEqual(self.server.requests, 5)
+
+    def test_app_info_domain_list_async(self):
+        apps = self._apps(12)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('domains.txt', 'w') as domains:
+                domains.write("".join(f"{app['domain_canonical']}\n" for app in apps))
+            result = self._invoke(['--async-io', 'app-info', '--domain-list', 'domains.txt'])
+            with open('app_info.ndjson') as output:
+                rows = [json.loads(line) for line in output]
+        self.assertSucceeded(result)
+        self.assertEqual([row['name'] for row in rows], [app['name'] for app in apps])
+        self.assertEqual(self.server.requests, 12)
+
+    def test_supply_chain_graph_async(self):
+        args = ['supply-chain-graph', '--app-name', self.tenant.apps_by_id['117']['name'], '--max-depth', '3',
+                '--output-format', 'JSON']
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self.assertSucceeded(self._invoke(args))
+            with open('supply_chain.txt') as output:
+                expected = json.load(output)
+            result = self._invoke(['--async-io'] + args)
+            with open('supply_chain.txt') as output:
+                graph = json.load(output)
+        self.assertSucceeded(result)
+        self.assertGreater(len(graph['edges']), 5)
+        self.assertEqual(graph, expected)
+
+    def test_bulk_app_set_rejects_async(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            self._write_app_list('apps.txt', self._apps(2))
+            result = self._invoke(['--async-io', 'bulk-set-app-field', '--field', "APPROVAL STATUS", "--value",
+                                   "Approved", '--app-list', 'apps.txt'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("--async-io is not supported by bulk-set-app-field", result.output)
+        self.assertEqual(self.server.requests, 0)
@@ -0,0 +1,318 @@
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = "/api/1.0"
+
+FIELDS = {
+    "Approval Status": ["Approved", "Acceptable", "In Review", "Rejected"],
+    "SSO Provider": ["Okta", "Azure AD", "Google"],
+    "Risk": ["High", "Medium", "Low"],
+}
+CATEGORIES = ["AI Tools", "Collaboration", "Developer Tools", "Marketing", "Security", "Finance"]
+WORDS = ["zoom", "miro", "flow", "dock", "send", "cloud", "data", "pixel", "stack", "sync", "grid", "note",
+         "chat", "mail", "task", "book", "desk", "pay", "link", "base", "hub", "form", "scan", "lens"]
+
+
+class MockTenant:
+    # synthetic organization with a deterministic set of fields and apps
+
+    def __init__(self, app_count=1000, seed=42) -> None:
+        super().__init__()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.fields = []
+        for field_id, (name, values) in enumerate(FIELDS.items(), start=9000):
+            self.fields.append({
+                "id": field_id, "name": name, "field_type": "SELECT", "scopes": ["app"],
+                "field_scopes": [{"scope": "saas"}],
+                "allowed_values": [{"id": field_id * 10 + index, "value": value} for index, value in enumerate(values)]
+            })
+        self.apps = [self._make_app(app_id) for app_id in range(1, app_count + 1)]
+        self.apps.sort(key=lambda app: app['account_count'], reverse=True)
+        self.apps_by_id = {str(app['id']): app for app in self.apps}
+        self._search_results = {}
+
+    def _make_app(self, app_id):
+        name = f"{self.random.choice(WORDS).title()}{self.random.choice(WORDS)} {app_id}"
+        domain = f"{name.split(' ')[0].lower()}{app_id}.com"
+        accounts = int(self.random.paretovariate(1.2) * 3)
+        fields = []
+        for field in self.fields:
+            if self.random.random() < 0.6:
+                fields.append({"field": {"id": field['id'], "name": field['name']},
+                               "allowed_value": self.random.choice(field['allowed_values'])})
+        return {
+            "id": app_id, "name": name, "account_count": accounts, "domain_canonical": domain,
+            "service_info": {"name": name, "service_canonical_domain": domain,
+                             "category": {"name": self.random.choice(CATEGORIES)}},
+            "counters": {"total_accounts": accounts},
+            "fields": fields,
+        }
+
+    def field(self, field_id):
+        for field in self.fields:
+            if str(field['id']) == str(field_id):
+                return field
+        return None
+
+    def search_apps(self, search):
+        # page requests of one search share the filtered result, as a database cursor would
+        key = json.dumps(search.get('search', []), sort_keys=True)
+        with self.lock:
+            if key not in self._search_results:
+                self._search_results[key] = [app for app in self.apps if _matches(app, search.get('search', []))]
+            return self._search_results[key]
+
+    def set_field(self, app_id, field_id, value):
+        app = self.apps_by_id.get(str(app_id))
+        field = self.field(field_id)
+        if app is None or field is None:
+            return False
+        allowed = next((allowed for allowed in field['allowed_values']
+                        if allowed['value'].casefold() == str(value).casefold()), {"id": None, "value": value})
+        with self.lock:
+            app['fields'] = [entry for entry in app['fields'] if entry['field']['id'] != field['id']]
+            app['fields'].append({"field": {"id": field['id'], "name": field['name']}, "allowed_value": allowed})
+            self._search_results.clear()
+        return True
+
+    def vendors(self, domain):
+        rng = random.Random(domain)
+        return [{"app_name": app['name'], "domain_canonical": app['domain_canonical']}
+                for app in rng.sample(self.apps, min(len(self.apps), rng.randint(0, 5)))]
+
+
+def _like(value, pattern, op):
+    if value is None:
+        return False
+    if op == '=':
+        return str(value).casefold() == str(pattern).casefold()
+    return str(pattern).strip('%').casefold() in str(value).casefold()
+
+
+def _matches(app, clauses):
+    if not clauses:
+        return True
+    for clause in clauses:
+        prop, op, value = clause.get('property'), clause.get('op'), clause.get('value')
+        if prop == 'fields':
+            values = [entry['allowed_value']['value'] for entry in app['fields']
+                      if entry['field']['name'] == clause.get('field_name')]
+            if (op == 'isnull' and not values) or (op != 'isnull' and value in values):
+                return True
+        elif prop == 'category':
+            if _like(app['service_info']['category']['name'], value, '='):
+                return True
+        elif prop == 'service_info.name':
+            if _like(app['service_info']['name'], value, op):
+                return True
+        elif _like(app.get(prop), value, op):
+            return True
+    return False
+
+
+def _project(app, properties):
+    projected = {}
+    for prop in properties:
+        source, target = app, projected
+        keys = prop.split('.')
+        for key in keys[:-1]:
+            source = source.get(key) or {}
+            target = target.setdefault(key, {})
+        target[keys[-1]] = source.get(keys[-1])
+    return projected
+
+
+def _page(values, body):
+    page = int(body.get('page') or 1)
+    per_page = int(body.get('per_page') or 50)
+    start = (page - 1) * per_page
+    next_page = page + 1 if start + per_page < len(values) else None
+    return {"values": values[start:start + per_page], "next_page": next_page, "total": len(values)}
+
+
+class MockNudgeServer:
+    # local stand-in for the API, every response is delayed by latency plus up to jitter seconds
+    # and a throttle_rate share of the requests answer 429 with a Retry-After
+
+    def __init__(self, tenant: MockTenant, latency=0.0, jitter=0.0, throttle_rate=0.0, retry_after=0,
+                 bulk_endpoint=True) -> None:
+        super().__init__()
+        self.tenant = tenant
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.bulk_endpoint = bulk_endpoint
+        self.request_times = []
+        self.requests = 0
+        self.throttled = 0
+        self.compressed = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._random = random.Random(7)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.request_times = []
+            self.requests = 0
+            self.throttled = 0
+            self.compressed = 0
+            self.connections = set()
+
+    def _record(self, elapsed, throttled, client, compressed):
+        with self._lock:
+            self.requests += 1
+            self.connections.add(client)
+            self.compressed += compressed
+            self.request_times.append(elapsed)
+            if throttled:
+                self.throttled += 1
+
+    def _should_throttle(self):
+        with self._lock:
+            return self.throttle_rate > 0 and self._random.random() < self.throttle_rate
+
+    def _delay(self):
+        with self._lock:
+            return self.latency + (self._random.random() * self.jitter if self.jitter else 0)
+
+    def route(self, method, path, body, headers=None):
+        # answers (status, payload) or (status, payload, response headers)
+        tenant = self.tenant
+        if method == 'POST' and path == '/fields/search':
+            return 200, _page(tenant.fields, body)
+        if method == 'POST' and path == '/fields':
+            field = {"id": 9000 + len(tenant.fields), "name": body['name'], "field_type": body.get('field_type'),
+                     "scopes": body.get('scopes', []), "field_scopes": [], "allowed_values": []}
+            tenant.fields.append(field)
+            return 200, field
+        match = re.fullmatch(r'/fields/(\d+)', path)
+        if method == 'PUT' and match:
+            field = tenant.field(match.group(1))
+            if field is None:
+                return 404, {"error": "field not found"}
+            field.update({key: value for key, value in body.items() if key in ('name', 'scopes')})
+            return 200, field
+        match = re.fullmatch(r'/fields/(\d+)/allowed_values', path)
+        if method == 'POST' and match:
+            field = tenant.field(match.group(1))
+            if field is None:
+                return 404, {"error": "field not found"}
+            allowed = {"id": int(match.group(1)) * 10 + len(field['allowed_values']), "value": body['value']}
+            field['allowed_values'].append(allowed)
+            return 200, allowed
+        match = re.fullmatch(r'/fields/(\d+)/apps', path)
+        if method == 'POST' and match:
+            if not self.bulk_endpoint:
+                return 404, {"error": "not found"}
+            updated = sum(tenant.set_field(app_id, match.group(1), body['value']) for app_id in body.get('app_ids', []))
+            return 200, {"updated": updated}
+        if method == 'POST' and path == '/apps/search':
+            page = _page(tenant.search_apps(body), body)
+            if body.get('properties'):
+                page['values'] = [_project(app, body['properties']) for app in page['values']]
+            return 200, page
+        match = re.fullmatch(r'/apps/(\w+)/fields/(\d+)', path)
+        if method == 'POST' and match:
+            if not tenant.set_field(match.group(1), match.group(2), body.get('value')):
+                return 404, {"error": "app or field not found"}
+            return 200, {"status": "ok"}
+        match = re.fullmatch(r'/api/service/vendors/(.+)', path)
+        if method == 'GET' and match:
+            return 200, {"vendors": tenant.vendors(match.group(1))}
+        match = re.fullmatch(r'/api/service/details/(.+)', path)
+        if method == 'GET' and match:
+            domain = match.group(1)
+            etag = f'"{zlib.crc32(domain.encode("utf-8"))}"'
+            if headers and headers.get('If-None-Match') == etag:
+                return 304, None, {"ETag": etag}
+            app = next((app for app in tenant.apps if app['domain_canonical'] == domain), None)
+            return 200, {"domain": domain, "name": app['name'] if app else domain,
+                         "category": app['service_info']['category'] if app else None,
+                         "hosting": {"country": "US", "provider": "aws"}, "certifications": ["SOC2"]}, {"ETag": etag}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self, method):
+                start = time.perf_counter()
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                compressed = self.headers.get('Content-Encoding') == 'gzip'
+                if compressed:
+                    raw = gzip.decompress(raw)
+                delay = server._delay()
+                if delay:
+                    time.sleep(delay)
+                # counted before the reply is written, a client may read the stats as soon as it has the response
+                if server._should_throttle():
+                    server._record(time.perf_counter() - start, True, self.client_address, compressed)
+                    self._respond(429, {"error": "throttled"}, {"Retry-After": str(server.retry_after)})
+                    return
+                path = self.path.split('?')[0]
+                if not path.startswith(API_PREFIX):
+                    status, payload, headers = 404, {"error": "unknown api"}, None
+                else:
+                    body = json.loads(raw) if raw else {}
+                    status, payload, *headers = server.route(method, path[len(API_PREFIX):], body, self.headers)
+                    headers = headers[0] if headers else None
+                server._record(time.perf_counter() - start, False, self.client_address, compressed)
+                self._respond(status, payload, headers)
+
+            def _respond(self, status, payload, headers=None):
+                data = json.dumps(payload).encode('utf-8') if status != 304 else b''
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_PUT(self):
+                self._handle('PUT')
+
+        return Handler